@@ -0,0 +1,229 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import traceback
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+import cv2
+
+import instrumentation
+from instrumentation import Recorder, span
+from video_processing import AnalysisCancelled, VideoProcessor
+
+# Set in each worker process by _init_worker
+_events = None
+_cancel = None
+
+
+def _init_worker(events, cancel, instrument=False):
+    global _events, _cancel
+    # Ctrl-C reaches the whole process group; only the parent handles it, and
+    # stops the workers through the cancel event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Parallelism comes from the pool; OpenCV's own threads would oversubscribe
+    cv2.setNumThreads(1)
+    _events = events
+    _cancel = cancel
+    if instrument:
+        instrumentation.enable(process_name=f"worker {os.getpid()}")
+
+
+def _analyze(job_id, video_index, video_path, target_path, params, shards, checkpoint_interval):
+    def progress(frames_done, total_frames):
+        _events.put(("progress", job_id, video_index, frames_done, total_frames))
+
+    if _cancel.is_set():
+        raise AnalysisCancelled(video_path)
+    _events.put(("started", job_id, video_index))
+    try:
+        with span("video"):
+            processor = VideoProcessor(**params)
+            return processor.analyze_video(video_path, target_path, progress=progress, cancel=_cancel,
+                                           shards=shards, checkpoint_interval=checkpoint_interval)
+    finally:
+        # What this video cost, failed or not; the worker's recorder starts
+        # over for its next video
+        snapshot = instrumentation.take_snapshot()
+        if snapshot is not None:
+            _events.put(("stats", job_id, video_index, snapshot))
+
+
+class BatchJob:
+    def __init__(self, job_id, videos, target_path, params, indices=None):
+        self.job_id = job_id
+        self.videos = list(videos)
+        self.target_path = target_path
+        self.params = params
+        # Which of the videos run; a resumed job skips the finished ones
+        self.indices = list(range(len(self.videos))) if indices is None else list(indices)
+        # Keyed by index into self.videos, which may list a file twice
+        self.progress = [0.0] * len(self.videos)
+        self.outputs = {}
+        self.failures = {}
+        self.cancelled = set()
+        # Stage timings and counters of the job's videos when the executor
+        # instruments, see instrumentation.Recorder
+        self.stats = None
+
+    @property
+    def finished(self):
+        return len(self.outputs) + len(self.failures) + len(self.cancelled) == len(self.indices)
+
+    @property
+    def fraction_done(self):
+        if not self.indices:
+            return 1.0
+        return sum(self.progress[index] for index in self.indices) / len(self.indices)
+
+
+class BatchExecutor:
+    # Runs queued (videos, target_path, params) jobs on a process pool. Every
+    # video is its own task so a job with many videos still spreads over all
+    # workers. Workers report through a multiprocessing queue which the owner
+    # drains with poll(), e.g. from a Tk after() loop. With shards > 1 each
+    # video is further split into frame ranges on processes of its own, which
+    # is what keeps the cores busy when there are fewer videos than workers.
+    # With instrument=True workers record stage timings and counters, which
+    # poll() collects per job and into this process's instrumentation
+    # recorder (enabled here if it is not yet).
+
+    def __init__(self, max_workers=None, shards=1, checkpoint_interval=None, instrument=False):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.shards = shards
+        self.checkpoint_interval = checkpoint_interval
+        self.instrument = instrument
+        if instrument:
+            instrumentation.enable()
+        # spawn keeps worker processes clear of the GUI's Tk state and threads
+        context = multiprocessing.get_context("spawn")
+        self._events = context.Queue()
+        self._cancel = context.Event()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._events, self._cancel, instrument),
+        )
+        self._ids = itertools.count(1)
+        self._futures = []
+        self.jobs = {}
+        # Videos submitted but not started yet, and the start times of the
+        # running ones, for queue_depth and utilization()
+        self.queue_depth = 0
+        self._running = {}
+        self._busy = 0.0
+        self._created = time.monotonic()
+
+    def submit(self, videos, target_path, params, job_id=None, indices=None):
+        # job_id lets a caller use its own ids, e.g. those of a JobQueue;
+        # indices limits the run to some of the videos
+        if job_id is None:
+            job_id = next(self._ids)
+        job = BatchJob(job_id, videos, target_path, params, indices)
+        if self.instrument:
+            job.stats = Recorder(trace=False)
+        self.jobs[job.job_id] = job
+        self.queue_depth += len(job.indices)
+        for index in job.indices:
+            future = self._executor.submit(_analyze, job.job_id, index, job.videos[index], target_path, params,
+                                           self.shards, self.checkpoint_interval)
+            future.add_done_callback(
+                lambda f, job_id=job.job_id, index=index: self._on_done(job_id, index, f)
+            )
+            self._futures.append(future)
+        return job.job_id
+
+    def _on_done(self, job_id, index, future):
+        # Runs on the executor's management thread; hand over to poll()
+        try:
+            output = future.result()
+        except (CancelledError, AnalysisCancelled, KeyboardInterrupt):
+            self._events.put(("cancelled", job_id, index))
+        except BaseException as exc:
+            # Anything escaping here would kill the management thread, and no
+            # further results would be posted. The worker's traceback travels
+            # as the exception's __cause__.
+            message = "".join(traceback.format_exception_only(type(exc), exc))
+            if exc.__cause__ is not None:
+                message += str(exc.__cause__)
+            self._events.put(("failed", job_id, index, message))
+        else:
+            self._events.put(("done", job_id, index, output))
+
+    def poll(self):
+        # Apply all pending worker events to self.jobs and return them; the
+        # bookkeeping "started" and "stats" events are only applied
+        events = []
+        while True:
+            try:
+                event = self._events.get_nowait()
+            except queue.Empty:
+                break
+            kind, job_id, index = event[:3]
+            job = self.jobs[job_id]
+            if kind == "started":
+                if index in job.outputs or index in job.failures or index in job.cancelled:
+                    # Overtaken by its own result, which already counted it
+                    continue
+                self.queue_depth -= 1
+                self._running[job_id, index] = time.monotonic()
+                continue
+            if kind == "stats":
+                job.stats.merge(event[3], events=False)
+                recorder = instrumentation.recorder()
+                if recorder is not None:
+                    recorder.merge(event[3])
+                continue
+            if kind != "progress":
+                started = self._running.pop((job_id, index), None)
+                if started is None:
+                    # Cancelled before it started
+                    self.queue_depth -= 1
+                else:
+                    self._busy += time.monotonic() - started
+            if kind == "progress":
+                frames_done, total_frames = event[3:]
+                if total_frames > 0:
+                    job.progress[index] = min(frames_done / total_frames, 1.0)
+            elif kind == "done":
+                job.progress[index] = 1.0
+                job.outputs[index] = event[3]
+            elif kind == "failed":
+                job.failures[index] = event[3]
+            elif kind == "cancelled":
+                job.cancelled.add(index)
+            events.append(event)
+        instrumentation.gauge("queue_depth", self.queue_depth)
+        instrumentation.gauge("workers_busy", len(self._running))
+        return events
+
+    def utilization(self):
+        # Fraction of the workers' time since the executor started spent
+        # analysing videos, as far as poll() has seen
+        now = time.monotonic()
+        busy = self._busy + sum(now - started for started in self._running.values())
+        elapsed = now - self._created
+        return busy / (self.max_workers * elapsed) if elapsed > 0 else 0.0
+
+    @property
+    def finished(self):
+        return all(job.finished for job in self.jobs.values())
+
+    def cancel(self):
+        # Pending tasks never start, running ones stop at their next progress check
+        self._cancel.set()
+        for future in self._futures:
+            future.cancel()
+
+    def failure_report(self):
+        lines = []
+        for job in self.jobs.values():
+            for index, message in sorted(job.failures.items()):
+                lines.append(f"Job {job.job_id}: {job.videos[index]}\n{message}")
+        return "\n".join(lines)
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
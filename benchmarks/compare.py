@@ -0,0 +1,50 @@
+# Compares two reports of benchmarks.pipeline stage by stage:
+#
+#   python -m benchmarks.compare baseline.json current.json --fail-below 0.8
+#
+# Exits with 1 when --fail-below is given and a stage's throughput dropped
+# below that fraction of the baseline's.
+import argparse
+import json
+import sys
+
+
+def stage_key(result):
+    video = result["video"]
+    return (video["codec"], video["width"], video["height"], video["key_interval"], result["stage"])
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    return {stage_key(result): result for result in report["results"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--fail-below", type=float,
+                        help="fail when a stage's fps falls below this fraction of the baseline's")
+    args = parser.parse_args(argv)
+
+    baseline, current = load(args.baseline), load(args.current)
+    regressions = 0
+    for key in sorted(set(baseline) & set(current)):
+        old, new = baseline[key]["fps"], current[key]["fps"]
+        if not old or not new:
+            continue
+        ratio = new / old
+        slower = args.fail_below is not None and ratio < args.fail_below
+        regressions += slower
+        codec, width, height, key_interval, stage = key
+        print(f"{codec:<5} {width}x{height:<5} g{key_interval:<4} {stage:<20} "
+              f"{old:10.1f} -> {new:10.1f} fps  x{ratio:5.2f}{'  REGRESSION' if slower else ''}")
+    for name, only in (("baseline", set(baseline) - set(current)), ("current", set(current) - set(baseline))):
+        if only:
+            print(f"{len(only)} stages only in the {name} report")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+# Per-stage benchmark of the analysis frame path on synthetic drop videos:
+#
+#   python -m benchmarks.pipeline --sizes 640x480,1920x1080 --out bench.json
+#
+# Run from the repository root. For each codec and frame size a video is
+# generated, then seek, sequential decode, color conversion, rotate/crop,
+# edge detection, every fitter, result writing and a whole analyze_range run
+# are timed separately, as is loading the results back. The JSON report
+# holds fps, p50/p99 latency per frame and the peak memory each stage
+# allocates; benchmarks.compare diffs two reports. Needs no display.
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from benchmarks.synthetic import CODECS, write_drop_video
+from fitting import FITTERS
+from results_store import ResultsFile
+from timeline_index import TimelineIndex
+from video_processing import RESULT_COLUMNS, VideoProcessor, seek
+
+REPORT_VERSION = 1
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the drop analysis frame path.")
+    parser.add_argument("--codecs", default="MJPG,mp4v", help=f"comma-separated, from {', '.join(CODECS)}")
+    parser.add_argument("--sizes", default="640x480,1920x1080", help="comma-separated WIDTHxHEIGHT")
+    parser.add_argument("--key-intervals", default="12", help="comma-separated requested GOP sizes")
+    parser.add_argument("--frames", type=int, default=120, help="frames per generated video")
+    parser.add_argument("--pool", type=int, default=30,
+                        help="decoded frames kept in memory to feed the per-frame stages")
+    parser.add_argument("--seeks", type=int, default=30, help="random seeks per video")
+    parser.add_argument("--fitters", default=",".join(FITTERS), help="comma-separated fitters to time")
+    parser.add_argument("--rotation", type=float, default=2.0, help="rotation angle of the analysis")
+    parser.add_argument("--work-dir", help="keep generated videos here and reuse them (default: temporary)")
+    parser.add_argument("--out", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--quiet", action="store_true", help="do not print a summary to stderr")
+    return parser.parse_args(argv)
+
+
+class Stage:
+    # Latency samples of one stage, in nanoseconds per unit of work; fps
+    # counts frames, frames_per_unit of them per unit
+    def __init__(self, name, unit="frame", frames_per_unit=1):
+        self.name = name
+        self.unit = unit
+        self.frames_per_unit = frames_per_unit
+        self.samples = []
+        self.peak_bytes = None
+
+    def time(self, function, *args):
+        start = time.perf_counter_ns()
+        result = function(*args)
+        self.samples.append(time.perf_counter_ns() - start)
+        return result
+
+    def report(self):
+        samples = np.array(self.samples, dtype=np.float64) / 1e6
+        total = samples.sum()
+        return {
+            "stage": self.name,
+            "unit": self.unit,
+            "count": int(samples.size),
+            "fps": samples.size * self.frames_per_unit / (total / 1e3) if total else None,
+            "mean_ms": float(samples.mean()) if samples.size else None,
+            "p50_ms": float(np.percentile(samples, 50)) if samples.size else None,
+            "p99_ms": float(np.percentile(samples, 99)) if samples.size else None,
+            "peak_alloc_mb": None if self.peak_bytes is None else self.peak_bytes / 2**20,
+        }
+
+
+def peak_allocation(function, *args):
+    # Peak bytes allocated through Python/NumPy while function runs. Traced
+    # separately from the timed runs, which tracing would slow down.
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        function(*args)
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def measured_gop(path):
+    # Mean keyframe spacing the encoder actually produced, None if unknown
+    keyframes = TimelineIndex.build(path, thumbnails=1).keyframes
+    if len(keyframes) < 2:
+        return None
+    return float(np.diff(keyframes).mean())
+
+
+def bench_video(path, params, args, fitters):
+    stages = []
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video: {path}")
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        decode = Stage("decode")
+        pool = []
+        while True:
+            ok, frame = decode.time(cap.read)
+            if not ok:
+                decode.samples.pop()
+                break
+            if len(pool) < args.pool:
+                pool.append(frame)
+
+        def decode_all():
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            for _ in range(min(frame_count, args.pool)):
+                cap.read()
+
+        decode.peak_bytes = peak_allocation(decode_all)
+        stages.append(decode)
+
+        seeks = Stage("seek")
+        targets = np.random.default_rng(0).integers(0, max(frame_count, 1), args.seeks)
+
+        def seek_and_read(target):
+            seek(cap, int(target))
+            return cap.read()
+
+        for target in targets:
+            seeks.time(seek_and_read, target)
+        seeks.peak_bytes = peak_allocation(seek_and_read, targets[0])
+        stages.append(seeks)
+    finally:
+        cap.release()
+    if not pool:
+        raise IOError(f"No frames decoded from {path}")
+
+    # The per-frame stages cycle through the pooled frames for as many frames
+    # as the video has, so decode cost stays out of them
+    def frames():
+        for index in range(frame_count):
+            yield pool[index % len(pool)]
+
+    convert = Stage("color_convert")
+    for frame in frames():
+        convert.time(cv2.cvtColor, frame, cv2.COLOR_BGR2GRAY)
+    convert.peak_bytes = peak_allocation(cv2.cvtColor, pool[0], cv2.COLOR_BGR2GRAY)
+    stages.append(convert)
+
+    processor = VideoProcessor(**params)
+    rotate_crop = Stage("rotate_crop")
+    rois = []
+    for index, frame in enumerate(frames()):
+        roi = rotate_crop.time(processor.extract_roi, frame, True)
+        if index < len(pool):
+            rois.append(roi.copy())
+    rotate_crop.peak_bytes = peak_allocation(VideoProcessor(**params).extract_roi, pool[0], True)
+    stages.append(rotate_crop)
+
+    edges = Stage("edges")
+    edge_maps = []
+    for index in range(frame_count):
+        result = edges.time(cv2.Canny, rois[index % len(rois)], processor.threshold1, processor.threshold2)
+        if index < len(rois):
+            edge_maps.append(result)
+    edges.peak_bytes = peak_allocation(cv2.Canny, rois[0], processor.threshold1, processor.threshold2)
+    stages.append(edges)
+
+    rows = []
+    for fitter in fitters:
+        fit = Stage(f"fit:{fitter}")
+        fitting = VideoProcessor(**params, fitter=fitter)
+        # In frame order, so warm-starting fitters see consecutive frames
+        for index in range(frame_count):
+            gray, edge_map = rois[index % len(rois)], edge_maps[index % len(rois)]
+            measurement = fit.time(fitting.measure_edges, edge_map, gray)
+            if fitter == fitters[0]:
+                rows.append((index, index / 25.0) + measurement)
+        fit.peak_bytes = peak_allocation(VideoProcessor(**params, fitter=fitter).measure_edges, edge_maps[0], rois[0])
+        stages.append(fit)
+
+    write = Stage("write", unit="video", frames_per_unit=len(rows))
+    read = Stage("read", unit="video", frames_per_unit=len(rows))
+
+    def load(output_path):
+        # Opening maps the file; touching every column pages it in
+        results = ResultsFile(output_path)
+        return [float(results[name].sum()) for name in RESULT_COLUMNS]
+
+    with tempfile.TemporaryDirectory() as target:
+        for _ in range(5):
+            output_path = write.time(processor.write_results, path, target, rows)
+        write.peak_bytes = peak_allocation(processor.write_results, path, target, rows)
+        for _ in range(5):
+            read.time(load, output_path)
+        read.peak_bytes = peak_allocation(load, output_path)
+    stages.extend((write, read))
+
+    end_to_end = Stage("analyze_range", unit="video", frames_per_unit=frame_count)
+    end_to_end.time(VideoProcessor(**params).analyze_range, path)
+    stages.append(end_to_end)
+    return [stage.report() for stage in stages]
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=10,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "report_version": REPORT_VERSION,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "opencv_threads": cv2.getNumThreads(),
+    }
+
+
+def run(args):
+    fitters = [name for name in args.fitters.split(",") if name]
+    unknown = set(fitters) - set(FITTERS)
+    if unknown:
+        raise SystemExit(f"error: unknown fitters: {', '.join(sorted(unknown))}")
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="drop-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        results = bench_videos(args, fitters, work_dir)
+    finally:
+        # Generated videos are only kept when the caller chose where they go
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    meta = environment()
+    # ru_maxrss is in kilobytes on Linux
+    meta["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None
+    return {"meta": meta, "results": results}
+
+
+def bench_videos(args, fitters, work_dir):
+    results = []
+    for codec in args.codecs.split(","):
+        if codec not in CODECS:
+            raise SystemExit(f"error: unknown codec {codec!r}, expected one of {', '.join(CODECS)}")
+        for size in args.sizes.split(","):
+            width, height = parse_size(size)
+            for key_interval in (int(value) for value in args.key_intervals.split(",")):
+                name = f"drop_{codec}_{width}x{height}_g{key_interval}_{args.frames}"
+                path = os.path.join(work_dir, name + CODECS[codec])
+                params = write_drop_video(path, codec, width, height, args.frames, key_interval=key_interval,
+                                          rotation_angle=args.rotation)
+                video = {
+                    "codec": codec, "width": width, "height": height, "frames": args.frames,
+                    "key_interval": key_interval, "measured_gop": measured_gop(path),
+                    "file_mb": os.path.getsize(path) / 2**20, "params": params,
+                }
+                for stage in bench_video(path, params, args, fitters):
+                    results.append(dict(stage, video=video))
+                    if not args.quiet:
+                        print(f"{name:<32} {stage['stage']:<20} {stage['fps'] or 0:10.1f} fps "
+                              f"p50 {stage['p50_ms'] or 0:8.3f} ms  p99 {stage['p99_ms'] or 0:8.3f} ms",
+                              file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
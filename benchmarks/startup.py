@@ -0,0 +1,172 @@
+# Time from launching the GUI to its main window being on screen:
+#
+#   python -m benchmarks.startup --runs 5 --out startup.json
+#   python -m benchmarks.startup --baseline startup.json --fail-above 1.25
+#
+# Run from the repository root. Each run starts a fresh interpreter that
+# imports gui, builds VideoAnalysisGUI and waits until the main window is
+# visible, once against an empty job queue and once against a queue holding
+# a job left over from an earlier session. The report holds the median, min
+# and max of the time to first window (measured from launching the process)
+# in both cases and of the gui import alone. Exits with 1 when any of
+# HEAVY_MODULES was loaded by the time the window showed (the GUI imports
+# them lazily), when a median exceeds --max-ms, or when it is more than
+# --fail-above times the --baseline report's. Without a display the window
+# cannot be created; the run then times everything up to that point and
+# says so in the report.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.pipeline import environment
+from job_queue import JobQueue
+
+REPORT_VERSION = 2
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Third-party modules the main window must not wait for
+HEAVY_MODULES = ("numpy", "cv2", "PIL")
+
+CHILD = r"""
+import json, sys, time
+start = time.perf_counter()
+import tkinter as tk
+from gui import VideoAnalysisGUI
+result = {"import_ms": (time.perf_counter() - start) * 1e3, "display": True}
+try:
+    root = tk.Tk()
+except tk.TclError as e:
+    result["display"] = False
+    result["error"] = str(e)
+else:
+    VideoAnalysisGUI(root)
+    root.wait_visibility(root)
+    root.update_idletasks()
+result["heavy_loaded"] = sorted(name for name in sys.argv[1:] if name in sys.modules)
+print(json.dumps(result), flush=True)
+if result["display"]:
+    root.destroy()
+"""
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the GUI's time to first window.")
+    parser.add_argument("--runs", type=int, default=5, help="GUI launches to time")
+    parser.add_argument("--max-ms", type=float, help="fail when the median time to first window exceeds this")
+    parser.add_argument("--baseline", help="earlier report of this benchmark to compare with")
+    parser.add_argument("--fail-above", type=float, default=1.25,
+                        help="fail when the median exceeds this multiple of the baseline's (default: 1.25)")
+    parser.add_argument("--out", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--quiet", action="store_true", help="do not print a summary to stderr")
+    return parser.parse_args(argv)
+
+
+def launch(home):
+    # One GUI launch: (ms from starting the process to the child's report,
+    # the child's report)
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+    start = time.perf_counter()
+    child = subprocess.Popen([sys.executable, "-c", CHILD, *HEAVY_MODULES], cwd=ROOT, env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    line = child.stdout.readline()
+    elapsed = (time.perf_counter() - start) * 1e3
+    _, errors = child.communicate()
+    if child.returncode or not line:
+        raise RuntimeError(f"GUI launch failed:\n{errors}")
+    return elapsed, json.loads(line)
+
+
+def queue_job(home):
+    # A job as the GUI stores it, in the queue the GUI opens under home
+    job_queue = JobQueue(os.path.join(home, ".cache", "drop-analysis", "queue.sqlite3"))
+    try:
+        job_queue.add([os.path.join(home, "drop.mp4")], os.path.join(home, "results"), {
+            "crop_coords": (10, 10, 110, 110), "rotation_angle": 2, "baseline_y": 80, "threshold1": 50,
+            "threshold2": 150, "fitter": "polynomial", "sampling": {"padding": 5},
+        })
+    finally:
+        job_queue.close()
+
+
+def summary(samples):
+    return {"median_ms": statistics.median(samples), "min_ms": min(samples), "max_ms": max(samples)}
+
+
+def run(args):
+    first_window, first_window_queued, imports, heavy = [], [], [], set()
+    display = True
+    for _ in range(max(1, args.runs)):
+        for queued, samples in ((False, first_window), (True, first_window_queued)):
+            # A fresh home each time, so every launch finds only the queue
+            # set up here
+            with tempfile.TemporaryDirectory(prefix="drop-startup-") as home:
+                if queued:
+                    queue_job(home)
+                elapsed, result = launch(home)
+            samples.append(elapsed)
+            imports.append(result["import_ms"])
+            heavy.update(result["heavy_loaded"])
+            display = display and result["display"]
+    return {
+        "meta": dict(environment(), startup_report_version=REPORT_VERSION),
+        "display": display,
+        "runs": len(first_window),
+        "first_window": summary(first_window),
+        "first_window_queued": summary(first_window_queued),
+        "gui_import": summary(imports),
+        "heavy_loaded": sorted(heavy),
+    }
+
+
+def check(report, args):
+    # Regression messages, empty when the report passes
+    problems = []
+    if report["heavy_loaded"]:
+        problems.append(f"loaded before the first window: {', '.join(report['heavy_loaded'])}")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["display"] != report["display"]:
+            problems.append("baseline was measured with" + ("" if baseline["display"] else "out") + " a display")
+            baseline = None
+    for key, label in (("first_window", "time to first window"),
+                       ("first_window_queued", "time to first window with a queued job")):
+        median = report[key]["median_ms"]
+        if args.max_ms is not None and median > args.max_ms:
+            problems.append(f"median {label} {median:.0f} ms exceeds {args.max_ms:.0f} ms")
+        # Reports of version 1 have no queued launches
+        if baseline is not None and key in baseline:
+            old = baseline[key]["median_ms"]
+            if median > old * args.fail_above:
+                problems.append(f"median {label} {median:.0f} ms is x{median / old:.2f} the baseline's {old:.0f} ms")
+    return problems
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    problems = check(report, args)
+    if not args.quiet:
+        window, queued = report["first_window"], report["first_window_queued"]
+        print(f"first window{'' if report['display'] else ' (no display: up to creating it)'}: "
+              f"median {window['median_ms']:.0f} ms, min {window['min_ms']:.0f} ms, max {window['max_ms']:.0f} ms; "
+              f"with a queued job median {queued['median_ms']:.0f} ms; "
+              f"gui import median {report['gui_import']['median_ms']:.0f} ms", file=sys.stderr)
+    for problem in problems:
+        print(f"REGRESSION: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import math
+
+import cv2
+import numpy as np
+
+from video_processing import rotation_matrix
+
+# Codecs to benchmark and the container each is written in
+CODECS = {"MJPG": ".avi", "mp4v": ".mp4", "XVID": ".avi", "FFV1": ".mkv"}
+
+BACKGROUND = 190
+DROP = 60
+SUBSTRATE = 120
+
+
+def drop_geometry(width, height, rotation_angle):
+    # Where the drop sits in the rotated image (the level scene the analysis
+    # sees once it applies rotation_angle), and the crop_coords and
+    # baseline_y that frame it there, as the GUI picks them
+    _, (rotated_width, rotated_height) = rotation_matrix(width, height, rotation_angle)
+    radius = height * 0.18
+    baseline = rotated_height / 2.0 + height * 0.12
+    center_x = rotated_width / 2.0
+    crop_coords = (int(center_x - 1.6 * radius), int(baseline - 2.1 * radius),
+                   int(math.ceil(center_x + 1.6 * radius)), int(math.ceil(baseline + 0.4 * radius)))
+    # The substrate starts at row int(baseline)
+    baseline_y = int(baseline) - crop_coords[1]
+    return (center_x, baseline, radius), crop_coords, baseline_y
+
+
+def render_frame(width, height, index, frame_count, geometry, noise, rotation_angle=0.0):
+    # A sessile drop whose contact angle swings between about 60 and 120
+    # degrees over the video, on a substrate, with sensor noise. The scene is
+    # drawn level in the rotated image and turned back by -rotation_angle, so
+    # the camera looks tilted and the analysis rotation levels it again.
+    center_x, baseline, radius = geometry
+    matrix, (rotated_width, rotated_height) = rotation_matrix(width, height, rotation_angle)
+    angle = math.radians(90.0 + 30.0 * math.sin(2.0 * math.pi * index / max(frame_count, 1)))
+    # Spherical cap of constant base width: the centre moves with the angle
+    circle_radius = radius / math.sin(angle)
+    center_y = baseline + circle_radius * math.cos(angle)
+    scene = np.full((rotated_height, rotated_width, 3), BACKGROUND, dtype=np.uint8)
+    scale = 16  # cv2 drawing with 4 fractional bits
+    cv2.circle(scene, (int(center_x * scale), int(center_y * scale)), int(circle_radius * scale),
+               (DROP, DROP, DROP), -1, cv2.LINE_AA, shift=4)
+    scene[int(baseline):] = SUBSTRATE
+    if rotation_angle % 360:
+        # matrix maps rotated-image pixels to frame pixels; its inverse
+        # finds the scene pixel behind each frame pixel
+        forward = np.linalg.inv(np.vstack([matrix, [0.0, 0.0, 1.0]]))[:2]
+        frame = cv2.warpAffine(scene, forward, (width, height), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                               borderMode=cv2.BORDER_REPLICATE)
+    else:
+        frame = scene
+    return cv2.add(frame, noise[index % len(noise)], dtype=cv2.CV_8U)
+
+
+def write_drop_video(path, codec, width, height, frame_count, fps=25.0, key_interval=None,
+                     rotation_angle=0.0, seed=0):
+    # Writes a synthetic sessile-drop video and returns the analysis
+    # parameters for it (crop_coords, rotation_angle, baseline_y). The key
+    # interval is a request; not every OpenCV build passes it to the encoder,
+    # so benchmarks measure the GOP they actually got.
+    params = []
+    if key_interval:
+        params = [cv2.VIDEOWRITER_PROP_KEY_INTERVAL, int(key_interval)]
+    writer = cv2.VideoWriter(path, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*codec), fps, (width, height), params)
+    if not writer.isOpened():
+        raise IOError(f"Could not open a {codec} writer for {path}")
+    rng = np.random.default_rng(seed)
+    noise = [rng.integers(0, 6, (height, width, 3), dtype=np.uint8) for _ in range(4)]
+    geometry, crop_coords, baseline_y = drop_geometry(width, height, rotation_angle)
+    try:
+        for index in range(frame_count):
+            writer.write(render_frame(width, height, index, frame_count, geometry, noise, rotation_angle))
+    finally:
+        writer.release()
+    return {"crop_coords": crop_coords, "rotation_angle": rotation_angle, "baseline_y": baseline_y}
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import shutil
+
+import numpy as np
+
+from results_store import RESULTS_EXTENSION, ResultsFile, ResultsWriter
+
+# Crash-safe partial results. Each run over a frame range appends its rows to
+# a part file of its own (see results_store) at every checkpoint, as a chunk
+# covering the frames [start, stop) since the previous checkpoint. A chunk
+# that made it to disk is valid, and after an interruption only the frames
+# no chunk covers have to be analysed again. Every part records the
+# fingerprint of the analysis that wrote it (VideoProcessor.fingerprint), and
+# parts of any other analysis are ignored.
+
+
+def checkpoint_dir(target_path, video_path):
+    # Videos of the same name from different directories get directories of
+    # their own
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    digest = hashlib.sha256(os.path.abspath(video_path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(target_path, f".{name}_analysis.{digest}.parts")
+
+
+def open_part(directory, start, columns, fingerprint):
+    # ResultsWriter for the run starting at frame start; checkpoint with
+    # append(data, start, stop, eof), where eof marks that the video ended at
+    # stop. A range only restarts where no matching chunk covers it, so an
+    # existing part of that name is either continued (it holds no chunks) or
+    # left from another analysis and replaced.
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{start:012d}{RESULTS_EXTENSION}")
+    metadata = {"fingerprint": fingerprint}
+    try:
+        writer = ResultsWriter(path, columns, metadata=metadata)
+    except ValueError:
+        writer = None
+    if writer is not None and writer.metadata.get("fingerprint") == fingerprint:
+        return writer
+    if writer is not None:
+        writer.close()
+    os.remove(path)
+    return ResultsWriter(path, columns, metadata=metadata)
+
+
+def read_parts(directory, fingerprint):
+    # [(start, stop, eof, columns)] of every chunk written with fingerprint,
+    # sorted by start, with columns mapping names to arrays; unreadable parts
+    # are left out so their frames get analysed again
+    parts = []
+    if not os.path.isdir(directory):
+        return parts
+    for name in os.listdir(directory):
+        if not name.endswith(RESULTS_EXTENSION):
+            continue
+        try:
+            with ResultsFile(os.path.join(directory, name)) as results:
+                if results.metadata.get("fingerprint") != fingerprint:
+                    continue
+                # Copied out so no mapping keeps the directory from being
+                # removed on platforms that lock mapped files
+                for chunk in results.chunks:
+                    columns = {name: np.array(column) for name, column in chunk.columns.items()}
+                    parts.append((chunk.start, chunk.stop, chunk.eof, columns))
+        except (OSError, ValueError):
+            continue
+    # A range's last chunk can be empty of frames, [stop, stop), and still
+    # hold the lead-in of a movement right after the range; it goes before
+    # the next range's chunks
+    parts.sort(key=lambda part: part[:2])
+    return parts
+
+
+def missing_ranges(parts):
+    # Frame ranges [start, stop) no part covers yet; stop is None for "to the
+    # end of the video" while the end has not been reached
+    ranges = []
+    covered = 0
+    end = None
+    for start, stop, eof, _ in parts:
+        if start > covered:
+            ranges.append((covered, start))
+        covered = max(covered, stop)
+        if eof:
+            end = stop if end is None else min(end, stop)
+    if end is None:
+        ranges.append((covered, None))
+    elif covered < end:
+        ranges.append((covered, end))
+    return ranges
+
+
+def merge_parts(parts, columns):
+    # All part rows in frame order, as {name: array} for the (name, dtype)
+    # columns
+    return {
+        name: np.concatenate([np.asarray(part[name], dtype=dtype) for _, _, _, part in parts]
+                             or [np.empty(0, dtype=dtype)])
+        for name, dtype in columns
+    }
+
+
+def clear_parts(directory):
+    shutil.rmtree(directory, ignore_errors=True)
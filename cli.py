@@ -0,0 +1,129 @@
+# Headless batch runner: runs the jobs of a manifest exported from the GUI
+# (or written by hand) without tkinter, for render nodes and schedulers.
+#
+#   python cli.py jobs.json --workers 16 --report report.json
+#
+# --stats records per-stage timings and counters of every job (into the
+# report, and summed up on stderr); --trace also writes them as a Chrome
+# trace for chrome://tracing or Perfetto.
+#
+# Exit codes: 0 all videos analysed, 1 some videos failed, 2 unusable
+# manifest, 130 interrupted. Rerunning a manifest skips the videos whose
+# results of the same settings are complete, and resumes the others, failed
+# ones included, from their last checkpoint.
+import argparse
+import json
+import os
+import sys
+import time
+
+import instrumentation
+from batch import BatchExecutor
+from job_queue import DEFAULT_CHECKPOINT_INTERVAL
+from jobs import ManifestError, load_manifest
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_BAD_MANIFEST = 2
+EXIT_INTERRUPTED = 130
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run drop analysis jobs from a JSON or TOML manifest.")
+    parser.add_argument("manifest", help="manifest with a top-level 'jobs' list")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: all cores)")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="frame-range shards per video (default: spread idle workers over the videos)")
+    parser.add_argument("--checkpoint-interval", type=int, default=DEFAULT_CHECKPOINT_INTERVAL,
+                        help="save partial results every this many frames so a rerun resumes (0 disables)")
+    parser.add_argument("--report", help="write a JSON report of outputs and failures to this path")
+    parser.add_argument("--stats", action="store_true",
+                        help="record stage timings and counters and print a summary")
+    parser.add_argument("--trace", help="record stats and write them as a Chrome trace to this path")
+    parser.add_argument("--quiet", action="store_true", help="do not print progress")
+    return parser.parse_args(argv)
+
+
+def write_report(path, executor):
+    jobs = []
+    for job in executor.jobs.values():
+        jobs.append({
+            "videos": job.videos,
+            "target_path": job.target_path,
+            "outputs": {job.videos[i]: output for i, output in sorted(job.outputs.items())},
+            "failures": {job.videos[i]: message for i, message in sorted(job.failures.items())},
+            "cancelled": [job.videos[i] for i in sorted(job.cancelled)],
+        })
+        if job.stats is not None:
+            jobs[-1]["stats"] = job.stats.summary()
+    report = {"jobs": jobs}
+    if executor.instrument:
+        report["utilization"] = executor.utilization()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        jobs = load_manifest(args.manifest)
+    except (OSError, ManifestError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_BAD_MANIFEST
+
+    video_count = sum(len(videos) for videos, _, _ in jobs)
+    if not video_count:
+        print("error: manifest has no videos", file=sys.stderr)
+        return EXIT_BAD_MANIFEST
+    workers = max(1, args.workers)
+    shards = args.shards if args.shards is not None else max(1, workers // video_count)
+
+    executor = BatchExecutor(max_workers=min(workers, video_count), shards=max(1, shards),
+                             checkpoint_interval=args.checkpoint_interval or None,
+                             instrument=args.stats or bool(args.trace))
+    interrupted = False
+    try:
+        for videos, target_path, params in jobs:
+            executor.submit(videos, target_path, params)
+        while not executor.finished:
+            time.sleep(0.5)
+            for event in executor.poll():
+                if args.quiet or event[0] == "progress":
+                    continue
+                job = executor.jobs[event[1]]
+                print(f"[job {job.job_id}] {event[0]}: {job.videos[event[2]]}", file=sys.stderr)
+    except KeyboardInterrupt:
+        interrupted = True
+        executor.cancel()
+        while not executor.finished:
+            time.sleep(0.1)
+            executor.poll()
+    finally:
+        executor.shutdown(wait=True)
+        # Stats the workers sent after their last result
+        executor.poll()
+
+    report = executor.failure_report()
+    if report:
+        print(report, file=sys.stderr)
+    if args.report:
+        write_report(args.report, executor)
+    recorder = instrumentation.recorder()
+    if recorder is not None:
+        if not args.quiet:
+            print(f"worker utilization: {executor.utilization():.0%}", file=sys.stderr)
+            print("\n".join(instrumentation.format_summary(recorder.summary())), file=sys.stderr)
+        if args.trace:
+            recorder.export_trace(args.trace)
+
+    if interrupted:
+        return EXIT_INTERRUPTED
+    if report:
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
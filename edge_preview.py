@@ -0,0 +1,133 @@
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+from video_processing import VideoProcessor
+
+# Overlay colours (RGB)
+EDGE_COLOR = (255, 255, 255)
+CONTOUR_COLOR = (0, 255, 0)
+BASELINE_COLOR = (255, 0, 0)
+
+
+def analysis_still(frame_bgr, crop_coords=None, rotation_angle=0):
+    # (image_rgb, gray) of a video frame's crop, taken the way the analysis
+    # takes it: VideoProcessor.extract_roi's bilinear warp of the frame, with
+    # gray converted before the warp. The GUI's PIL-rotated crop differs
+    # from that by interpolation whenever the rotation is not a multiple of
+    # 360 degrees.
+    processor = VideoProcessor(crop_coords=crop_coords, rotation_angle=rotation_angle)
+    # extract_roi reuses its buffers, so gray is copied out first
+    gray = processor.extract_roi(frame_bgr, gray=True).copy()
+    image_rgb = cv2.cvtColor(processor.extract_roi(frame_bgr), cv2.COLOR_BGR2RGB)
+    return image_rgb, gray
+
+
+class EdgeMap:
+    # Canny edges of one still at any thresholds. The gradients Canny works
+    # from do not depend on the thresholds, so they are computed once here
+    # and each threshold change only reruns non-maximum suppression and
+    # hysteresis, which cv2.Canny does given dx and dy. The result is
+    # identical to cv2.Canny on the grayscale image, as VideoProcessor runs
+    # it; pass the analysis' own grayscale crop as gray (see analysis_still)
+    # to get the analysis' edges exactly.
+
+    def __init__(self, image_rgb, gray=None):
+        if gray is not None:
+            self.gray = np.ascontiguousarray(gray)
+        elif image_rgb.ndim == 3:
+            self.gray = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY)
+        else:
+            self.gray = np.ascontiguousarray(image_rgb)
+        # Same aperture and border handling as Canny's own Sobel pass
+        self.dx = cv2.Sobel(self.gray, cv2.CV_16S, 1, 0, ksize=3, borderType=cv2.BORDER_REPLICATE)
+        self.dy = cv2.Sobel(self.gray, cv2.CV_16S, 0, 1, ksize=3, borderType=cv2.BORDER_REPLICATE)
+        # The overlay's background: the still, dimmed so the edges stand out
+        base = self.gray if image_rgb.ndim == 2 else image_rgb
+        self.background = (np.atleast_3d(base) * 0.4).astype(np.uint8)
+        if self.background.shape[2] == 1:
+            self.background = np.repeat(self.background, 3, axis=2)
+
+    def edges(self, threshold1, threshold2):
+        return cv2.Canny(self.dx, self.dy, threshold1, threshold2)
+
+
+class EdgePreviewWorker:
+    # Renders edge previews of one still on a background thread. Only the
+    # newest request matters: requests arriving while one is being rendered
+    # replace each other, so a dragged slider never queues up work. Finished
+    # previews are collected with result(), from the Tk thread. A request
+    # that fails to render posts its exception instead, and the worker goes
+    # on with the next one.
+
+    def __init__(self, image_rgb, gray=None):
+        self._image = image_rgb
+        self._gray = gray
+        self._edge_map = None
+        self._request = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._results = queue.Queue()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name="edge-preview")
+        self._thread.start()
+
+    def submit(self, **settings):
+        # settings are VideoProcessor arguments: threshold1, threshold2,
+        # baseline_y, fitter, ...
+        with self._lock:
+            self._request = settings
+        self._wake.set()
+
+    def result(self):
+        # (overlay_rgb, measurement, error) of the newest finished preview,
+        # or None. error is the exception a failed render raised, with
+        # overlay_rgb and measurement None.
+        latest = None
+        while True:
+            try:
+                latest = self._results.get_nowait()
+            except queue.Empty:
+                return latest
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                request, self._request = self._request, None
+                self._wake.clear()
+            if self._stopped:
+                return
+            if request is not None:
+                try:
+                    overlay, measurement = self.render(**request)
+                except Exception as e:
+                    self._results.put((None, None, e))
+                else:
+                    self._results.put((overlay, measurement, None))
+
+    def render(self, **settings):
+        if self._edge_map is None:
+            self._edge_map = EdgeMap(self._image, self._gray)
+        edge_map = self._edge_map
+        processor = VideoProcessor(**settings)
+        edges = edge_map.edges(processor.threshold1, processor.threshold2)
+
+        overlay = edge_map.background.copy()
+        overlay[edges > 0] = EDGE_COLOR
+        measurement = (np.nan,) * 6
+        contour = processor.drop_contour(edges, edge_map.gray)
+        if contour is not None:
+            ys, left, right, baseline = contour
+            measurement = processor.measure_contour(ys, left, right, baseline)
+            columns = np.clip(np.rint(np.concatenate([left, right])).astype(np.intp), 0, overlay.shape[1] - 1)
+            overlay[np.concatenate([ys, ys]), columns] = CONTOUR_COLOR
+        if processor.baseline_y > 0:
+            overlay[min(processor.baseline_y, overlay.shape[0] - 1)] = BASELINE_COLOR
+        return overlay, measurement
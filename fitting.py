@@ -0,0 +1,380 @@
+import math
+
+import numpy as np
+
+# Contact-angle models, from cheapest to most expensive per frame
+FITTERS = ("polynomial", "circle", "ellipse", "young_laplace")
+
+# Every fitter's fit() returns (left_angle, right_angle, base_width, volume,
+# fit_residual) in degrees and pixels. volume is None when the model does not
+# describe the whole drop; the caller then integrates the measured profile.
+_FAILED = (np.nan, np.nan, np.nan, None, np.nan)
+
+
+def refine_columns(gray, rows, columns):
+    # Sub-pixel x positions of edge pixels (rows[i], columns[i]): the peak of a
+    # parabola through the horizontal gradient magnitude at the pixel and its
+    # two neighbours, all pixels at once
+    width = gray.shape[1]
+    window = np.clip(columns[:, None] + np.arange(-2, 3), 0, width - 1)
+    samples = gray[rows[:, None], window].astype(np.float32)
+    g0, g1, g2 = np.abs(samples[:, 2:] - samples[:, :-2]).T
+    curvature = g0 - 2.0 * g1 + g2
+    shift = np.zeros_like(curvature)
+    np.divide(0.5 * (g0 - g2), curvature, out=shift, where=curvature < 0)
+    return columns + np.clip(shift, -0.5, 0.5)
+
+
+def _contour_points(ys, left, right):
+    x = np.concatenate([left, right]).astype(np.float64)
+    y = np.concatenate([ys, ys]).astype(np.float64)
+    return x, y
+
+
+def fit_circle(x, y):
+    # Algebraic (Kasa) least-squares circle, solved in coordinates centred on
+    # the points; returns (xc, yc, radius)
+    mx, my = x.mean(), y.mean()
+    u, v = x - mx, y - my
+    design = np.column_stack([2.0 * u, 2.0 * v, np.ones_like(u)])
+    (uc, vc, c), *_ = np.linalg.lstsq(design, u * u + v * v, rcond=None)
+    return uc + mx, vc + my, math.sqrt(max(c + uc * uc + vc * vc, 0.0))
+
+
+def fit_conic(x, y):
+    # Direct least-squares ellipse (Fitzgibbon et al., in the numerically
+    # stable form of Halir and Flusser). Returns the coefficients
+    # (a, b, c, d, e, f) of a u^2 + b uv + c v^2 + d u + e v + f = 0 in
+    # normalised coordinates u = (x - mx) / scale, v = (y - my) / scale, and
+    # (mx, my, scale); None when the points do not determine an ellipse.
+    mx, my = x.mean(), y.mean()
+    scale = max(x.std(), y.std(), 1e-12)
+    u, v = (x - mx) / scale, (y - my) / scale
+    quadratic = np.column_stack([u * u, u * v, v * v])
+    linear = np.column_stack([u, v, np.ones_like(u)])
+    s1 = quadratic.T @ quadratic
+    s2 = quadratic.T @ linear
+    s3 = linear.T @ linear
+    try:
+        t = -np.linalg.solve(s3, s2.T)
+        m = s1 + s2 @ t
+        m = np.array([m[2] / 2.0, -m[1], m[0] / 2.0])
+        _, vectors = np.linalg.eig(m)
+    except np.linalg.LinAlgError:
+        return None
+    vectors = vectors.real
+    elliptic = 4.0 * vectors[0] * vectors[2] - vectors[1] ** 2 > 0
+    if elliptic.sum() != 1:
+        return None
+    a1 = vectors[:, elliptic][:, 0]
+    return np.concatenate([a1, t @ a1]), (mx, my, scale)
+
+
+def young_laplace_profiles(bonds, length, step=0.05):
+    # Axisymmetric sessile-drop profiles for every Bond number in bonds at
+    # once, in units of the apex radius of curvature: x(s), z(s) (z pointing
+    # down from the apex) and the tangent angle phi(s) along the arc length s,
+    # integrated from the apex with fixed-step RK4. Returns an array of shape
+    # (steps + 1, 3, len(bonds)).
+    bonds = np.asarray(bonds, dtype=np.float64)
+    steps = max(int(math.ceil(length / step)), 1)
+    h = length / steps
+
+    def derivative(state):
+        x, z, phi = state
+        sin_phi = np.sin(phi)
+        # sin(phi) / x tends to dphi/ds = 1 at the apex
+        ratio = np.ones_like(x)
+        np.divide(sin_phi, x, out=ratio, where=x > 1e-12)
+        return np.stack([np.cos(phi), sin_phi, 2.0 + bonds * z - ratio])
+
+    profiles = np.empty((steps + 1, 3, bonds.size))
+    state = np.zeros((3, bonds.size))
+    profiles[0] = state
+    for i in range(steps):
+        k1 = derivative(state)
+        k2 = derivative(state + 0.5 * h * k1)
+        k3 = derivative(state + 0.5 * h * k2)
+        k4 = derivative(state + h * k3)
+        state = state + (h / 6.0) * (k1 + 2.0 * k2 + 2.0 * k3 + k4)
+        profiles[i + 1] = state
+    return profiles
+
+
+# The tangent fit uses at most this fraction of the drop's height: on a low
+# drop, fit_rows would reach over the apex and fit the whole cap
+TANGENT_FRACTION = 0.3
+# Fewest contour rows per side the tangent fit needs
+MIN_TANGENT_ROWS = 4
+# Rows near the contact point can hold edge pixels of the substrate or its
+# reflection rather than the drop. The tangent fit drops the row it predicts
+# worst from the others (its leave-one-out residual) while that is more than
+# OUTLIER_SIGMA robust standard deviations, at most MAX_OUTLIER_ROWS times.
+# The deviation is at least OUTLIER_FLOOR pixels, about the noise of
+# sub-pixel edge positions.
+OUTLIER_SIGMA = 4.0
+OUTLIER_FLOOR = 0.5
+MAX_OUTLIER_ROWS = 3
+
+
+class PolynomialFitter:
+    # Tangent method: a quadratic x(y) per side through the contour rows
+    # closest to the baseline. Cheap and model-free, but only sees the foot of
+    # the drop. Drops too low to leave MIN_TANGENT_ROWS rows near the baseline
+    # are fitted with a spherical cap instead, which they are close to.
+
+    def __init__(self, fit_rows=20):
+        self.fit_rows = fit_rows
+        self._fallback = CircleFitter()
+
+    def reset(self):
+        pass
+
+    def fit(self, ys, left, right, baseline):
+        window = min(self.fit_rows, TANGENT_FRACTION * (baseline - ys[0]))
+        near = ys >= baseline - window
+        if np.count_nonzero(near) < MIN_TANGENT_ROWS:
+            return self._fallback.fit(ys, left, right, baseline)
+        fit_y = ys[near] - float(baseline)
+        fit_x = np.stack([left[near], right[near]]).astype(np.float64)
+        vander = np.vander(fit_y, 3)
+        coeffs, residuals = np.linalg.lstsq(vander, fit_x.T, rcond=None)[:2]
+        for _ in range(MAX_OUTLIER_ROWS):
+            if fit_y.size <= MIN_TANGENT_ROWS:
+                break
+            outlier = self._outlier(vander, fit_x, coeffs)
+            if outlier is None:
+                break
+            fit_y = np.delete(fit_y, outlier)
+            fit_x = np.delete(fit_x, outlier, axis=1)
+            vander = np.delete(vander, outlier, axis=0)
+            coeffs, residuals = np.linalg.lstsq(vander, fit_x.T, rcond=None)[:2]
+        # Centred on the baseline, so the constant term is the contact point
+        # and the linear term the slope there
+        contact_x = coeffs[2]
+        slope_left, slope_right = coeffs[1]
+        # dx/dy with y pointing down; measured through the liquid from the baseline
+        left_angle = math.degrees(math.atan2(1.0, -slope_left))
+        right_angle = math.degrees(math.atan2(1.0, slope_right))
+        if residuals.size:
+            fit_residual = math.sqrt(residuals.sum() / (2 * fit_y.size))
+        else:
+            fit_residual = 0.0
+        return left_angle, right_angle, contact_x[1] - contact_x[0], None, fit_residual
+
+    @staticmethod
+    def _outlier(vander, fit_x, coeffs):
+        # Index of the row whose worse side lies furthest from the fit of the
+        # other rows, or None when no row stands out. A row's leave-one-out
+        # residual is its residual / (1 - leverage), so the rows at the ends
+        # of the window, which pull the fit towards themselves, are not let
+        # off for it.
+        residual = np.abs(fit_x.T - vander @ coeffs).max(axis=1)
+        leverage = ((vander @ np.linalg.inv(vander.T @ vander)) * vander).sum(axis=1)
+        deleted = residual / np.maximum(1.0 - leverage, 1e-6)
+        # Robust standard deviation from the (upper) median residual
+        middle = residual.size // 2
+        sigma = max(1.4826 * float(np.partition(residual, middle)[middle]), OUTLIER_FLOOR)
+        worst = int(deleted.argmax())
+        if deleted[worst] <= OUTLIER_SIGMA * sigma:
+            return None
+        return worst
+
+
+class CircleFitter:
+    # Spherical cap through the whole contour. Exact for drops small enough
+    # that gravity does not flatten them, and closed-form.
+
+    def reset(self):
+        pass
+
+    def fit(self, ys, left, right, baseline):
+        x, y = _contour_points(ys, left, right)
+        xc, yc, radius = fit_circle(x, y)
+        if not radius:
+            return _FAILED
+        # Centre below the baseline (yc > baseline) means an angle under 90
+        angle = math.degrees(math.acos(min(max((yc - baseline) / radius, -1.0), 1.0)))
+        base_width = 2.0 * math.sqrt(max(radius * radius - (baseline - yc) ** 2, 0.0))
+        cap_height = baseline - yc + radius
+        volume = math.pi * cap_height * cap_height * (3.0 * radius - cap_height) / 3.0
+        distance = np.hypot(x - xc, y - yc) - radius
+        return angle, angle, base_width, volume, math.sqrt(float(np.mean(distance * distance)))
+
+
+class EllipseFitter:
+    # Ellipse through the whole contour, cut by the baseline. Allows for some
+    # flattening and for left/right asymmetry; closed-form.
+
+    def reset(self):
+        pass
+
+    def fit(self, ys, left, right, baseline):
+        x, y = _contour_points(ys, left, right)
+        if x.size < 6:
+            return _FAILED
+        conic = fit_conic(x, y)
+        if conic is None:
+            return _FAILED
+        (a, b, c, d, e, f), (mx, my, scale) = conic
+        v0 = (baseline - my) / scale
+        # Contact points: the conic's intersections with the baseline
+        p, q = b * v0 + d, c * v0 * v0 + e * v0 + f
+        discriminant = p * p - 4.0 * a * q
+        if discriminant < 0 or a == 0:
+            return _FAILED
+        roots = (-p + np.array([-1.0, 1.0]) * math.sqrt(discriminant)) / (2.0 * a)
+        u_left, u_right = np.sort(roots)
+        # dx/dy on the conic by implicit differentiation
+        slopes = -(b * np.array([u_left, u_right]) + 2.0 * c * v0 + e) / (
+            2.0 * a * np.array([u_left, u_right]) + b * v0 + d)
+        left_angle = math.degrees(math.atan2(1.0, -slopes[0]))
+        right_angle = math.degrees(math.atan2(1.0, slopes[1]))
+
+        # Sampson approximation of each point's geometric distance to the conic
+        u, v = (x - mx) / scale, (y - my) / scale
+        value = a * u * u + b * u * v + c * v * v + d * u + e * v + f
+        gradient = np.hypot(2.0 * a * u + b * v + d, b * u + 2.0 * c * v + e)
+        distance = scale * value / np.maximum(gradient, 1e-12)
+        return (left_angle, right_angle, (u_right - u_left) * scale, None,
+                math.sqrt(float(np.mean(distance * distance))))
+
+
+class YoungLaplaceFitter:
+    # Axisymmetric drop shape analysis: fits the apex position, apex radius b
+    # and Bond number of the Young-Laplace profile to the whole contour with
+    # Levenberg-Marquardt. The most faithful model and by far the most
+    # expensive, so each fit starts from the previous frame's solution, which
+    # between consecutive frames usually needs only a couple of iterations.
+    # iterations and fits count the work done, to judge the warm start.
+
+    def __init__(self, max_iterations=50, tolerance=1e-6, max_bond=100.0, step=0.05):
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.max_bond = max_bond
+        self.step = step
+        self.iterations = 0
+        self.fits = 0
+        self._previous = None
+
+    def reset(self):
+        self._previous = None
+
+    def _profiles(self, bonds, params, x, y, baseline):
+        # Long enough to reach the baseline: a convex arc inside a box of the
+        # contour's extent is at most twice its half width plus its height
+        half_width = float(np.max(np.abs(x - params[0])))
+        height = baseline - params[1]
+        length = 1.1 * (2.0 * half_width + max(height, 0.0)) / params[2] + 4 * self.step
+        profiles = young_laplace_profiles(bonds, length, self.step)
+        # Past phi = pi the profile would curl back over itself
+        return [profiles[profiles[:, 2, i] <= math.pi, :, i].T for i in range(len(bonds))]
+
+    def _residuals(self, params, profile, x, y):
+        # Signed distance of each point to the tangent line at the nearest
+        # profile sample, with its derivatives by apex x, apex y and b
+        xa, ya, b, _ = params
+        px, pz, phi = profile
+        r, z = np.abs(x - xa), y - ya
+        nearest = ((r[:, None] - b * px) ** 2 + (z[:, None] - b * pz) ** 2).argmin(axis=1)
+        sin_phi, cos_phi = np.sin(phi[nearest]), np.cos(phi[nearest])
+        distance = (r - b * px[nearest]) * sin_phi - (z - b * pz[nearest]) * cos_phi
+        jacobian = np.column_stack([
+            -np.sign(x - xa) * sin_phi,
+            cos_phi,
+            -px[nearest] * sin_phi + pz[nearest] * cos_phi,
+        ])
+        return distance, jacobian
+
+    def _initial(self, x, y):
+        # A Bond number of 0 is a sphere, so the circle fit is an exact start
+        # for small drops
+        xc, yc, radius = fit_circle(x, y)
+        return np.array([xc, yc - radius, max(radius, 1.0), 0.0])
+
+    def _step(self, jacobian, distance, damping):
+        normal = jacobian.T @ jacobian
+        return np.linalg.solve(normal + damping * np.diag(np.diag(normal) + 1e-12), -(jacobian.T @ distance))
+
+    def _bounded(self, params):
+        params[2] = max(params[2], 1.0)
+        params[3] = min(max(params[3], 0.0), self.max_bond)
+        return params
+
+    def fit(self, ys, left, right, baseline):
+        x, y = _contour_points(ys, left, right)
+        if x.size < 5:
+            return _FAILED
+        self.fits += 1
+        params = self._initial(x, y) if self._previous is None else self._previous.copy()
+        if not np.all(np.isfinite(params)):
+            return _FAILED
+
+        bond_step = 1e-4
+        # The profile at the current Bond number and a nudged one for the
+        # Bond derivative, integrated as one batch
+        profile, nudged = self._profiles([params[3], params[3] + bond_step], params, x, y, baseline)
+        distance, jacobian = self._residuals(params, profile, x, y)
+        cost = float(distance @ distance)
+        damping = 1e-3
+        for _ in range(self.max_iterations):
+            self.iterations += 1
+            nudged_distance = self._residuals(params, nudged, x, y)[0]
+            full = np.column_stack([jacobian, (nudged_distance - distance) / bond_step])
+            try:
+                delta = self._step(full, distance, damping)
+                if params[3] + delta[3] < 0.0:
+                    # Held at the sphere bound; solve for the other parameters
+                    delta = np.append(self._step(full[:, :3], distance, damping), 0.0)
+            except np.linalg.LinAlgError:
+                break
+            # Converged: the step would move the profile by under 1/1000 pixel
+            if np.abs(delta[:3]).max() < 1e-3 and abs(delta[3]) < 1e-6:
+                break
+            trial = self._bounded(params + delta)
+            trial_profile, trial_nudged = self._profiles([trial[3], trial[3] + bond_step], trial, x, y, baseline)
+            trial_distance, trial_jacobian = self._residuals(trial, trial_profile, x, y)
+            trial_cost = float(trial_distance @ trial_distance)
+            if trial_cost <= cost:
+                improvement = cost - trial_cost
+                params, profile, nudged = trial, trial_profile, trial_nudged
+                distance, jacobian, cost = trial_distance, trial_jacobian, trial_cost
+                damping = max(damping / 10.0, 1e-9)
+                if improvement <= self.tolerance * max(cost, 1e-12):
+                    break
+            else:
+                damping *= 10.0
+                if damping > 1e9:
+                    break
+
+        xa, ya, b, bond = params
+        fit_residual = math.sqrt(cost / x.size)
+        px, pz, phi = profile
+        z_base = (baseline - ya) / b
+        crossing = int(np.searchsorted(pz, z_base))
+        if crossing == 0 or crossing >= pz.size:
+            self._previous = None
+            return np.nan, np.nan, np.nan, None, fit_residual
+        self._previous = params
+
+        # Interpolate the profile where it meets the baseline
+        w = (z_base - pz[crossing - 1]) / (pz[crossing] - pz[crossing - 1])
+        angle = math.degrees((1.0 - w) * phi[crossing - 1] + w * phi[crossing])
+        contact_x = (1.0 - w) * px[crossing - 1] + w * px[crossing]
+        # pi * integral of x^2 dz from the apex down to the baseline
+        xs = np.append(px[:crossing], contact_x)
+        zs = np.append(pz[:crossing], z_base)
+        volume = math.pi * b ** 3 * float(np.sum(0.5 * (xs[1:] ** 2 + xs[:-1] ** 2) * np.diff(zs)))
+        return angle, angle, 2.0 * b * contact_x, volume, fit_residual
+
+
+def make_fitter(name, fit_rows=20):
+    if name == "polynomial":
+        return PolynomialFitter(fit_rows)
+    if name == "circle":
+        return CircleFitter()
+    if name == "ellipse":
+        return EllipseFitter()
+    if name == "young_laplace":
+        return YoungLaplaceFitter()
+    raise ValueError(f"Unknown fitter {name!r}, expected one of {', '.join(FITTERS)}")
@@ -0,0 +1,300 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from instrumentation import span
+from video_processing import seek
+
+DEFAULT_CACHE_MB = 512
+DEFAULT_PREFETCH_DEPTH = 8
+PLAYBACK_SPEEDS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0)
+
+# Without keyframe positions, jumps forward by at most this many frames are
+# decoded through instead of seeking, which would restart decoding from the
+# previous keyframe anyway
+MAX_FORWARD_DECODE = 30
+
+
+class FrameCache:
+    # LRU cache of decoded frames bounded by their total size in bytes
+
+    def __init__(self, limit_mb=DEFAULT_CACHE_MB):
+        self.limit = int(limit_mb * 1024 * 1024)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+
+    def get(self, index):
+        frame = self._frames.get(index)
+        if frame is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._frames.move_to_end(index)
+        return frame
+
+    def put(self, index, frame):
+        old = self._frames.pop(index, None)
+        if old is not None:
+            self.size -= old.nbytes
+        if frame.nbytes <= self.limit:
+            # Cached frames are shared with callers, so nobody may draw on them
+            frame.flags.writeable = False
+            self._frames[index] = frame
+            self.size += frame.nbytes
+        self._evict()
+
+    def set_limit(self, limit_mb):
+        # Evicts down to the new limit at once; like put(), not to be called
+        # while a PrefetchDecoder is filling the cache
+        self.limit = int(limit_mb * 1024 * 1024)
+        self._evict()
+
+    def _evict(self):
+        while self.size > self.limit:
+            _, evicted = self._frames.popitem(last=False)
+            self.size -= evicted.nbytes
+
+    def clear(self):
+        self._frames.clear()
+        self.size = 0
+
+
+class FrameReader:
+    # Random access to the frames of one video. Reads continue sequentially
+    # from the decoder's position when possible and only seek on real jumps;
+    # recently decoded frames are served from a FrameCache.
+
+    def __init__(self, video_path, cache_mb=DEFAULT_CACHE_MB):
+        self.video_path = video_path
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise IOError(f"Could not open video: {video_path}")
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.cache = FrameCache(cache_mb)
+        # Sorted keyframe indices, once a TimelineIndex has found them
+        self.keyframes = None
+        # Index of the frame the next cap.read() returns
+        self._position = 0
+
+    def _decode_through(self, index):
+        # Whether reaching index from the current position is cheaper by
+        # decoding forward than by seeking
+        if index <= self._position:
+            return False
+        keyframes = self.keyframes
+        if keyframes is not None and len(keyframes):
+            # A seek would restart at the last keyframe before index anyway;
+            # when that is behind us, decoding forward does strictly less work
+            position = np.searchsorted(keyframes, index, side="right")
+            return position == 0 or keyframes[position - 1] <= self._position
+        return index <= self._position + MAX_FORWARD_DECODE
+
+    def read(self, index):
+        # Returns the (read-only) BGR frame at index, or None past the end
+        frame = self.cache.get(index)
+        if frame is not None:
+            return frame
+
+        if index != self._position:
+            if self._decode_through(index):
+                while self._position < index and self.cap.grab():
+                    self._position += 1
+            else:
+                self._position = seek(self.cap, index)
+            if self._position != index:
+                return None
+
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        self._position += 1
+        self.cache.put(index, frame)
+        return frame
+
+    def release(self):
+        self.cap.release()
+        self.cache.clear()
+
+
+class PlaybackClock:
+    # Maps wall-clock time to the playback position that should be on screen.
+    # Positions count frames since playback started and keep growing when the
+    # video loops; frame index = position % frame_count.
+
+    def __init__(self, fps, speed=1.0):
+        self.fps = fps if fps and fps > 0 else 30.0
+        # (position, time, frames per second of wall time), replaced as a
+        # whole so the decode thread never sees a half-updated anchor
+        self._anchor = (0, time.perf_counter(), self.fps * speed)
+
+    @property
+    def speed(self):
+        return self._anchor[2] / self.fps
+
+    def start(self, position):
+        self._anchor = (position, time.perf_counter(), self._anchor[2])
+
+    def set_speed(self, speed):
+        now = time.perf_counter()
+        self._anchor = (self.position(now), now, self.fps * speed)
+
+    def position(self, now=None):
+        origin, started, rate = self._anchor
+        if now is None:
+            now = time.perf_counter()
+        return origin + (now - started) * rate
+
+    def time_until(self, position):
+        origin, started, rate = self._anchor
+        return started + (position - origin) / rate - time.perf_counter()
+
+
+class PrefetchSlot:
+    def __init__(self, shape):
+        self.index = None
+        self.position = None
+        self.image = np.empty(shape, dtype=np.uint8)
+
+
+class PrefetchDecoder:
+    # Decodes ahead of playback on a background thread. Frames are decoded and
+    # turned into display images by prepare(frame, out) straight into a fixed
+    # ring of preallocated slots, so the Tk thread only has to blit them.
+    # With a PlaybackClock, frames that would already be late are skipped with
+    # grab() instead of being decoded into a slot.
+    # The decoder owns the reader while it runs; stop() it before reading
+    # frames from anywhere else.
+
+    def __init__(self, reader, prepare, shape, depth=DEFAULT_PREFETCH_DEPTH, clock=None):
+        self.reader = reader
+        self.prepare = prepare
+        self.depth = depth
+        self.shape = shape
+        self.clock = clock
+        self.error = None
+        self.frames_skipped = 0
+        self.frames_dropped = 0
+        self._free = queue.Queue()
+        self._ready = queue.Queue()
+        for _ in range(depth):
+            self._free.put(PrefetchSlot(shape))
+        self._next = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, index):
+        self.stop()
+        self._stop.clear()
+        self.error = None
+        if self.clock is not None:
+            self.clock.start(index)
+        self._thread = threading.Thread(target=self._run, args=(index,), daemon=True,
+                                        name="prefetch-decoder")
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self._next is not None:
+            self._free.put(self._next)
+            self._next = None
+        while True:
+            try:
+                self._free.put(self._ready.get_nowait())
+            except queue.Empty:
+                break
+
+    def set_shape(self, shape):
+        # Replace the ring with buffers for images of a new shape
+        self.stop()
+        self.shape = shape
+        self._free = queue.Queue()
+        for _ in range(self.depth):
+            self._free.put(PrefetchSlot(shape))
+
+    def set_depth(self, depth):
+        # Replace the ring with one of depth slots
+        self.depth = depth
+        self.set_shape(self.shape)
+
+    def peek(self):
+        # Next decoded slot in frame order without taking it, or None
+        if self._next is None:
+            try:
+                self._next = self._ready.get_nowait()
+            except queue.Empty:
+                return None
+        return self._next
+
+    def get(self, due=None):
+        # Next decoded slot in frame order, or None if decoding has not caught
+        # up. With a due position, slots that are already late are dropped in
+        # favour of the newest one that is due, and slots that are not due yet
+        # stay queued. Hand the slot back with release() once its image has
+        # been used.
+        slot = None
+        while True:
+            candidate = self.peek()
+            if candidate is None or (due is not None and candidate.position > due):
+                break
+            self._next = None
+            if slot is not None:
+                self.release(slot)
+                self.frames_dropped += 1
+            slot = candidate
+            if due is None:
+                break
+        return slot
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def _run(self, position):
+        frame_count = self.reader.frame_count
+        try:
+            while not self._stop.is_set():
+                try:
+                    slot = self._free.get(timeout=0.05)
+                except queue.Empty:
+                    continue
+                if self.clock is not None:
+                    due = int(self.clock.position())
+                    if position < due:
+                        # Behind the clock: the reader grab()s through the
+                        # frames in between without retrieving them
+                        self.frames_skipped += due - position
+                        position = due
+                index = position % frame_count if frame_count > 0 else position
+                with span("preview_decode"):
+                    frame = self.reader.read(index)
+                if frame is None:
+                    self._free.put(slot)
+                    if index == 0 or frame_count <= 0:
+                        break
+                    # Frame count overestimated by the container; loop early
+                    position += frame_count - index
+                    continue
+                with span("preview_render"):
+                    self.prepare(frame, slot.image)
+                slot.index = index
+                slot.position = position
+                self._ready.put(slot)
+                position += 1
+        except Exception as e:
+            self.error = e
@@ -1,8 +1,43 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk
-import cv2
-# from video_processing import VideoProcessor  # Uncomment if you have this module
+import importlib
+import math
+import os
+import queue
+import threading
+import time
+import instrumentation
+from job_queue import DEFAULT_CHECKPOINT_INTERVAL, JobQueue
+from jobs import ManifestError, save_manifest
+
+# OpenCV, NumPy, PIL and the modules built on them are imported in the
+# methods that first need them rather than here. From a network-mounted
+# environment they take seconds to load, and the main window should not
+# wait for them; warm_up() loads them in the background once it is up.
+HEAVY_MODULES = (
+    "numpy", "cv2", "PIL.Image", "PIL.ImageTk",
+    "fitting", "sampling", "results_store", "video_processing", "frame_source", "preview",
+    "timeline_index", "edge_preview", "batch",
+)
+# Delay between the main window appearing and the warm-up starting, in ms
+WARM_UP_DELAY_MS = 100
+
+
+def warm_up():
+    # Imports HEAVY_MODULES and has OpenCV probe its video backends, which
+    # builds with plugin backends do on the first capture opened, so that
+    # neither holds up the first video the user opens
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+    import cv2
+    cv2.VideoCapture(os.path.join(os.path.dirname(os.path.abspath(__file__)), "missing-video.avi")).release()
+
+# Initial size of the playback preview in the Select Frame window
+PREVIEW_SIZE = (600, 400)
+# Room the timeline, filmstrip and buttons take below the preview
+PREVIEW_CONTROLS_HEIGHT = 220
+# Refresh period of the stats panel while stats are recorded, in ms
+STATS_REFRESH_MS = 500
 
 class ScrollableFrame(ttk.Frame):
     def __init__(self, container, *args, **kwargs):
@@ -33,15 +68,31 @@ class VideoAnalysisGUI:
         self.root.title("Video Analysis Tool")
         
         self.selected_videos = []
-        self.queue = []
+        # Survives restarts; jobs a crash interrupted are still pending here
+        self.job_queue = JobQueue()
+        self.checkpoint_interval = DEFAULT_CHECKPOINT_INTERVAL
         self.target_path = ""
         
         self.crop_coords = None
         self.rotation_angle = 0
         self.baseline_coords = None
         self.baseline_y = 0
+
+        self.executor = None
+        # None uses frame_source's DEFAULT_CACHE_MB and DEFAULT_PREFETCH_DEPTH
+        self.frame_cache_mb = None
+        self.prefetch_depth = None
+        self.preview_quality = "fast"
+        # Live edge preview of the cropped still
+        self.edge_preview = None
+        self.edge_preview_job = None
+        self.last_utilization = None
         
         self.setup_gui()
+        self.update_parameters()
+        self.update_stats()
+        self.warm_up_thread = None
+        self.root.after(WARM_UP_DELAY_MS, self.start_warm_up)
 
     def setup_gui(self):
         style = ttk.Style()
@@ -83,13 +134,28 @@ class VideoAnalysisGUI:
         # Threshold settings
         self.threshold1_label = ttk.Label(self.root, text="Threshold 1:")
         self.threshold1_label.grid(row=5, column=0, padx=10, pady=10)
-        self.threshold1_slider = tk.Scale(self.root, from_=0, to=255, orient=tk.HORIZONTAL, length=300)
+        self.threshold1_slider = tk.Scale(self.root, from_=0, to=255, orient=tk.HORIZONTAL, length=300, command=self.schedule_edge_preview)
         self.threshold1_slider.grid(row=5, column=1, padx=10, pady=10)
         
         self.threshold2_label = ttk.Label(self.root, text="Threshold 2:")
         self.threshold2_label.grid(row=6, column=0, padx=10, pady=10)
-        self.threshold2_slider = tk.Scale(self.root, from_=0, to=255, orient=tk.HORIZONTAL, length=300)
+        self.threshold2_slider = tk.Scale(self.root, from_=0, to=255, orient=tk.HORIZONTAL, length=300, command=self.schedule_edge_preview)
         self.threshold2_slider.grid(row=6, column=1, padx=10, pady=10)
+
+        # Contact-angle model
+        self.fitter_label = ttk.Label(self.root, text="Fitter:")
+        self.fitter_label.grid(row=6, column=2, padx=10, pady=10)
+        # The fitter list comes from fitting, loaded when the box first opens
+        self.fitter_var = tk.StringVar(value="polynomial")
+        self.fitter_combobox = ttk.Combobox(self.root, textvariable=self.fitter_var, values=(self.fitter_var.get(),),
+                                            postcommand=self.load_fitters, state="readonly", width=14)
+        self.fitter_combobox.grid(row=6, column=3, padx=10, pady=10)
+        self.fitter_combobox.bind("<<ComboboxSelected>>", self.schedule_edge_preview)
+
+        # Full analysis only around movement, every few frames elsewhere
+        self.adaptive_sampling_var = tk.BooleanVar(value=False)
+        self.adaptive_sampling_check = ttk.Checkbutton(self.root, text="Adaptive sampling", variable=self.adaptive_sampling_var)
+        self.adaptive_sampling_check.grid(row=5, column=3, padx=10, pady=10, sticky=tk.W)
         
         # Parameter display
         self.param_label = ttk.Label(self.root, text="Parameters:")
@@ -98,6 +164,11 @@ class VideoAnalysisGUI:
         self.param_display = tk.Text(self.root, height=10, width=60, wrap=tk.WORD)
         self.param_display.grid(row=7, column=1, padx=10, pady=10)
         self.param_display.config(state=tk.DISABLED)
+
+        # Stage timings and counters, while Record stats is on
+        self.stats_display = tk.Text(self.root, height=10, width=60, wrap=tk.NONE, font="TkFixedFont")
+        self.stats_display.grid(row=7, column=2, columnspan=2, padx=10, pady=10)
+        self.stats_display.config(state=tk.DISABLED)
         
         # Queue and start analysis
         self.queue_button = ttk.Button(self.root, text="Add to Queue", command=self.add_to_queue)
@@ -106,6 +177,32 @@ class VideoAnalysisGUI:
         self.start_button = ttk.Button(self.root, text="Start Analysis", command=self.start_analysis)
         self.start_button.grid(row=8, column=1, padx=10, pady=10)
 
+        self.export_button = ttk.Button(self.root, text="Export Queue", command=self.export_queue)
+        self.export_button.grid(row=8, column=2, padx=10, pady=10)
+
+        self.export_trace_button = ttk.Button(self.root, text="Export Trace", command=self.export_trace)
+        self.export_trace_button.grid(row=8, column=3, padx=10, pady=10)
+
+        # Batch execution
+        self.workers_label = ttk.Label(self.root, text="Workers:")
+        self.workers_label.grid(row=9, column=0, padx=10, pady=10)
+        self.workers_var = tk.IntVar(value=os.cpu_count() or 1)
+        self.workers_spinbox = ttk.Spinbox(self.root, from_=1, to=os.cpu_count() or 1, textvariable=self.workers_var, width=5)
+        self.workers_spinbox.grid(row=9, column=1, padx=10, pady=10, sticky=tk.W)
+
+        self.record_stats_var = tk.BooleanVar(value=False)
+        self.record_stats_check = ttk.Checkbutton(self.root, text="Record stats", variable=self.record_stats_var,
+                                                  command=self.toggle_stats)
+        self.record_stats_check.grid(row=9, column=2, padx=10, pady=10, sticky=tk.W)
+
+        self.retry_button = ttk.Button(self.root, text="Retry Failed", command=self.retry_failed)
+        self.retry_button.grid(row=9, column=3, padx=10, pady=10)
+
+        self.progress_bar = ttk.Progressbar(self.root, orient=tk.HORIZONTAL, length=300, maximum=1.0)
+        self.progress_bar.grid(row=10, column=1, padx=10, pady=10)
+        self.cancel_button = ttk.Button(self.root, text="Cancel Analysis", command=self.cancel_analysis, state=tk.DISABLED)
+        self.cancel_button.grid(row=10, column=0, padx=10, pady=10)
+
     def select_video(self):
         video_path = filedialog.askopenfilename(filetypes=[("Video files", "*.mp4;*.avi;*.mov")])
         if video_path:
@@ -123,8 +220,18 @@ class VideoAnalysisGUI:
             messagebox.showwarning("Warning", "Please select a video first.")
             return
         
+        from frame_source import (DEFAULT_CACHE_MB, DEFAULT_PREFETCH_DEPTH, PLAYBACK_SPEEDS, FrameReader,
+                                  PlaybackClock, PrefetchDecoder)
+        from preview import PREVIEW_QUALITIES, PreviewRenderer
+        from timeline_index import THUMBNAIL_HEIGHT
+
         video_path = self.selected_videos[-1]
-        self.cap = cv2.VideoCapture(video_path)
+        try:
+            cache_mb = DEFAULT_CACHE_MB if self.frame_cache_mb is None else self.frame_cache_mb
+            self.frame_reader = FrameReader(video_path, cache_mb=cache_mb)
+        except IOError as e:
+            messagebox.showerror("Error", str(e))
+            return
         
         self.video_window = tk.Toplevel(self.root)
         self.video_window.title("Select Frame")
@@ -140,9 +247,21 @@ class VideoAnalysisGUI:
 
         self.pause = False
 
-        self.timeline = tk.Scale(scrollable_frame.scrollable_frame, from_=0, to=int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))-1, orient=tk.HORIZONTAL, length=400, command=self.set_frame)
+        self.timeline = tk.Scale(scrollable_frame.scrollable_frame, from_=0, to=self.frame_reader.frame_count-1, orient=tk.HORIZONTAL, length=400, command=self.on_timeline_move)
         self.timeline.pack()
 
+        self.timestamp_label = ttk.Label(scrollable_frame.scrollable_frame, text="Indexing video...")
+        self.timestamp_label.pack()
+
+        self.filmstrip = tk.Canvas(scrollable_frame.scrollable_frame, width=400, height=THUMBNAIL_HEIGHT, highlightthickness=0)
+        self.filmstrip.pack()
+        self.filmstrip.bind("<Button-1>", self.on_filmstrip_click)
+        self.filmstrip_images = []
+        self.filmstrip_frames = []
+        self.filmstrip_marker = None
+        self.timeline_index = None
+        self.load_timeline_index(video_path)
+
         controls_frame = ttk.Frame(scrollable_frame.scrollable_frame)
         controls_frame.pack()
 
@@ -155,72 +274,303 @@ class VideoAnalysisGUI:
         self.next_frame_button = ttk.Button(controls_frame, text=">>", command=self.next_frame)
         self.next_frame_button.grid(row=0, column=2, padx=5, pady=5)
 
+        self.speed_var = tk.StringVar(value="1x")
+        self.speed_box = ttk.Combobox(controls_frame, textvariable=self.speed_var, state="readonly", width=6,
+                                      values=[f"{speed:g}x" for speed in PLAYBACK_SPEEDS])
+        self.speed_box.grid(row=0, column=3, padx=5, pady=5)
+        self.speed_box.bind("<<ComboboxSelected>>", self.set_playback_speed)
+
+        self.quality_var = tk.StringVar(value=self.preview_quality)
+        self.quality_box = ttk.Combobox(controls_frame, textvariable=self.quality_var, state="readonly", width=6,
+                                        values=PREVIEW_QUALITIES)
+        self.quality_box.grid(row=0, column=4, padx=5, pady=5)
+        self.quality_box.bind("<<ComboboxSelected>>", self.set_preview_quality)
+
+        ttk.Label(controls_frame, text="Cache (MB):").grid(row=0, column=5, padx=(5, 0), pady=5)
+        self.cache_size_var = tk.StringVar(value=str(self.frame_reader.cache.limit // (1024 * 1024)))
+        self.cache_size_box = ttk.Spinbox(controls_frame, textvariable=self.cache_size_var, from_=0, to=65536,
+                                          increment=128, width=7, command=self.set_frame_cache_size)
+        self.cache_size_box.grid(row=0, column=6, padx=5, pady=5)
+        self.cache_size_box.bind("<Return>", self.set_frame_cache_size)
+        self.cache_size_box.bind("<FocusOut>", self.set_frame_cache_size)
+
+        ttk.Label(controls_frame, text="Prefetch:").grid(row=0, column=7, padx=(5, 0), pady=5)
+        self.prefetch_depth_var = tk.StringVar(value=str(self.prefetch_depth or DEFAULT_PREFETCH_DEPTH))
+        self.prefetch_depth_box = ttk.Spinbox(controls_frame, textvariable=self.prefetch_depth_var, from_=1, to=256,
+                                              increment=1, width=5, command=self.set_prefetch_depth)
+        self.prefetch_depth_box.grid(row=0, column=8, padx=5, pady=5)
+        self.prefetch_depth_box.bind("<Return>", self.set_prefetch_depth)
+        self.prefetch_depth_box.bind("<FocusOut>", self.set_prefetch_depth)
+
         self.current_frame_pos = 0
+        self.displayed_frame_pos = None
+        self.timeline_pos = 0
+        self.playback_job = None
+        self.render_cost = 0.0
+        self.playback_clock = PlaybackClock(self.frame_reader.fps)
+        self.preview_renderer = PreviewRenderer(PREVIEW_SIZE, quality=self.preview_quality, upscale=True)
+        frame_shape = (self.frame_reader.height, self.frame_reader.width)
+        self.decoder = PrefetchDecoder(self.frame_reader, self.prepare_preview,
+                                       self.preview_renderer.output_shape(frame_shape),
+                                       depth=self.prefetch_depth or DEFAULT_PREFETCH_DEPTH,
+                                       clock=self.playback_clock)
+        self.resize_job = None
         self.show_frame()
 
         self.video_window.bind("<space>", self.toggle_pause)
+        self.video_window.bind("<Configure>", self.on_video_window_resize)
         self.video_window.protocol("WM_DELETE_WINDOW", self.on_video_window_close)
 
         self.select_frame_button = ttk.Button(scrollable_frame.scrollable_frame, text="Select Frame", command=self.capture_frame)
         self.select_frame_button.pack()
 
     def show_frame(self):
+        self.playback_job = None
         if not self.pause:
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_pos)
-            ret, frame = self.cap.read()
-            if ret:
-                self.current_frame = frame
-                self.display_frame(frame)
-                self.current_frame_pos += 1
-                self.timeline.set(self.current_frame_pos)
-                if self.current_frame_pos >= int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)):
-                    self.current_frame_pos = 0  # Loop the video
-            self.video_label.after(30, self.show_frame)
-    
-    def display_frame(self, frame):
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(frame_rgb)
+            if self.decoder.error is not None:
+                self.pause = True
+                self.stop_playback()
+                messagebox.showerror("Error", f"Could not decode video: {self.decoder.error}")
+                return
+            if not self.decoder.running:
+                self.decoder.start(self.current_frame_pos)
+            tick_start = time.perf_counter()
+            slot = self.decoder.get(due=self.playback_clock.position())
+            if slot is not None:
+                next_position = slot.position + 1
+                self.displayed_frame_pos = slot.index
+                self.blit_preview(slot.image)
+                self.decoder.release(slot)
+                self.move_timeline(self.displayed_frame_pos)
+                self.current_frame_pos = self.displayed_frame_pos + 1
+                # Running average of what one displayed frame costs on the Tk thread
+                self.render_cost = 0.8 * self.render_cost + 0.2 * (time.perf_counter() - tick_start)
+            else:
+                pending = self.decoder.peek()
+                next_position = pending.position if pending is not None else None
+            if next_position is not None:
+                delay = self.playback_clock.time_until(next_position) - self.render_cost
+            else:
+                delay = 0.005  # Decoder has not caught up yet
+            self.playback_job = self.video_label.after(max(1, int(delay * 1000)), self.show_frame)
+
+    def set_playback_speed(self, event=None):
+        self.playback_clock.set_speed(float(self.speed_var.get().rstrip("x")))
+
+    def stop_playback(self):
+        if self.playback_job is not None:
+            self.video_label.after_cancel(self.playback_job)
+            self.playback_job = None
+        self.decoder.stop()
 
-        # Resize the image to fit the label
-        img = img.resize((600, 400), Image.LANCZOS)
-        imgtk = ImageTk.PhotoImage(image=img)
+    def prepare_preview(self, frame, out):
+        # Called on the decode thread as well, so no Tk calls in here
+        self.preview_renderer.render(frame, out)
+
+    def blit_preview(self, image_rgb):
+        from preview import photo_image
+        imgtk = photo_image(image_rgb, master=self.video_window)
         self.video_label.imgtk = imgtk
         self.video_label.configure(image=imgtk)
 
+    def display_frame(self, frame):
+        self.blit_preview(self.preview_renderer.render(frame))
+
+    def on_video_window_resize(self, event):
+        # Fires for every child widget too, and many times while dragging
+        if event.widget is not self.video_window:
+            return
+        if self.resize_job is not None:
+            self.video_window.after_cancel(self.resize_job)
+        self.resize_job = self.video_window.after(150, self.apply_preview_size)
+
+    def apply_preview_size(self):
+        self.resize_job = None
+        width = max(160, self.video_window.winfo_width() - 40)
+        height = max(120, self.video_window.winfo_height() - PREVIEW_CONTROLS_HEIGHT)
+        # The decode thread renders with the renderer's settings, so it is
+        # stopped before they change; playback restarts it on the next tick
+        self.decoder.stop()
+        if self.preview_renderer.set_box(width, height):
+            self.rerender_preview()
+
+    def set_frame_cache_size(self, event=None):
+        try:
+            size_mb = int(self.cache_size_var.get())
+        except ValueError:
+            size_mb = -1
+        if size_mb < 0:
+            self.cache_size_var.set(str(self.frame_reader.cache.limit // (1024 * 1024)))
+            return
+        # Kept for the next video window as well. The decode thread fills
+        # the cache, so it is stopped first; playback restarts it.
+        self.frame_cache_mb = size_mb
+        self.decoder.stop()
+        self.frame_reader.cache.set_limit(size_mb)
+
+    def set_prefetch_depth(self, event=None):
+        try:
+            depth = int(self.prefetch_depth_var.get())
+        except ValueError:
+            depth = 0
+        if depth < 1:
+            self.prefetch_depth_var.set(str(self.decoder.depth))
+            return
+        # Kept for the next video window as well; playback restarts the
+        # decoder on the new ring
+        self.prefetch_depth = depth
+        if depth != self.decoder.depth:
+            self.decoder.set_depth(depth)
+
+    def set_preview_quality(self, event=None):
+        self.decoder.stop()
+        self.preview_renderer.quality = self.quality_var.get()
+        self.rerender_preview()
+
+    def rerender_preview(self):
+        # Callers stop the decoder before changing the renderer's settings
+        self.decoder.set_shape(self.preview_renderer.output_shape((self.frame_reader.height, self.frame_reader.width)))
+        if self.displayed_frame_pos is not None:
+            frame = self.frame_reader.read(self.displayed_frame_pos)
+            if frame is not None:
+                self.display_frame(frame)
+            if not self.pause:
+                self.current_frame_pos = self.displayed_frame_pos + 1
+
+    def move_timeline(self, pos):
+        from timeline_index import THUMBNAIL_HEIGHT
+        self.timeline_pos = pos
+        self.timeline.set(pos)
+        if self.timeline_index is not None and pos < self.timeline_index.frame_count:
+            self.timestamp_label.config(text=f"Frame {pos} at {self.timeline_index.timestamp(pos):.3f} s")
+            if self.filmstrip_marker is not None:
+                x = pos * int(self.filmstrip.cget("width")) / self.timeline_index.frame_count
+                self.filmstrip.coords(self.filmstrip_marker, x, 0, x, THUMBNAIL_HEIGHT)
+
+    def load_timeline_index(self, video_path):
+        # Index in the background with its own capture; results come back
+        # through a queue since Tk must only be touched from this thread
+        from timeline_index import TimelineIndex
+        self.index_cancel = threading.Event()
+        results = queue.Queue()
+
+        def build():
+            try:
+                results.put(TimelineIndex.load_or_build(video_path, cancel=self.index_cancel))
+            except Exception as e:
+                results.put(e)
+
+        threading.Thread(target=build, daemon=True, name="timeline-index").start()
+        self.poll_timeline_index(self.video_window, results)
+
+    def poll_timeline_index(self, window, results):
+        if not window.winfo_exists():
+            return
+        try:
+            result = results.get_nowait()
+        except queue.Empty:
+            window.after(100, self.poll_timeline_index, window, results)
+            return
+        if isinstance(result, Exception):
+            self.timestamp_label.config(text=f"Timeline index unavailable: {result}")
+            return
+        self.timeline_index = result
+        self.frame_reader.keyframes = result.keyframes
+        self.draw_filmstrip()
+        if self.displayed_frame_pos is not None:
+            self.move_timeline(self.displayed_frame_pos)
+
+    def draw_filmstrip(self):
+        from preview import photo_image
+        from timeline_index import THUMBNAIL_HEIGHT
+        index = self.timeline_index
+        self.filmstrip.delete("all")
+        self.filmstrip_images = []
+        self.filmstrip_frames = []
+        if not len(index.thumbnails) or not index.frame_count:
+            return
+        width = int(self.filmstrip.cget("width"))
+        thumbnail_width = index.thumbnails.shape[2]
+        count = max(1, width // thumbnail_width)
+        for slot in range(count):
+            # Thumbnail closest to the middle of the part of the video this slot covers
+            frame, thumbnail = index.thumbnail_for(int((slot + 0.5) * index.frame_count / count))
+            image = photo_image(thumbnail, master=self.filmstrip)
+            self.filmstrip.create_image(slot * thumbnail_width, 0, anchor=tk.NW, image=image)
+            self.filmstrip_images.append(image)  # To prevent garbage collection
+            self.filmstrip_frames.append(frame)
+        self.filmstrip_marker = self.filmstrip.create_line(0, 0, 0, THUMBNAIL_HEIGHT, fill='red', width=2)
+
+    def on_filmstrip_click(self, event):
+        if self.filmstrip_frames:
+            slot = min(event.x * len(self.filmstrip_frames) // int(self.filmstrip.cget("width")), len(self.filmstrip_frames) - 1)
+            self.set_frame(self.filmstrip_frames[max(slot, 0)])
+
+    def on_timeline_move(self, pos):
+        # Tk also calls this, later, for our own move_timeline() calls
+        if int(pos) != self.timeline_pos:
+            self.timeline_pos = int(pos)
+            self.set_frame(pos)
+
     def set_frame(self, pos):
-        self.current_frame_pos = int(pos)
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_pos)
-        ret, frame = self.cap.read()
-        if ret:
+        pos = int(pos)
+        if pos == self.displayed_frame_pos:
+            return
+        # The decode thread owns the reader; restart it from the new position
+        self.decoder.stop()
+        self.current_frame_pos = pos
+        frame = self.frame_reader.read(self.current_frame_pos)
+        if frame is not None:
             self.current_frame = frame
+            self.displayed_frame_pos = pos
             self.display_frame(frame)
+            self.current_frame_pos = pos + 1
+            self.move_timeline(pos)
     
     def toggle_pause(self, event=None):
         self.pause = not self.pause
-        if not self.pause:
+        if self.pause:
+            self.stop_playback()
+        elif self.playback_job is None:
             self.show_frame()
     
     def prev_frame(self):
-        self.current_frame_pos = max(0, self.current_frame_pos - 1)
-        self.set_frame(self.current_frame_pos)
+        self.set_frame(max(0, (self.displayed_frame_pos or 0) - 1))
     
     def next_frame(self):
-        self.current_frame_pos = min(int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)) - 1, self.current_frame_pos + 1)
-        self.set_frame(self.current_frame_pos)
+        self.set_frame(min(self.frame_reader.frame_count - 1, (self.displayed_frame_pos or 0) + 1))
     
     def on_video_window_close(self):
-        self.cap.release()
+        self.index_cancel.set()
+        self.stop_playback()
+        self.frame_reader.release()
         self.video_window.destroy()
     
     def capture_frame(self):
         self.pause = True
-        self.selected_frame_number = self.current_frame_pos  # Store the frame number
-        self.cap.release()
+        self.index_cancel.set()
+        self.stop_playback()
+        frame_number = self.displayed_frame_pos
+        if frame_number is None:
+            # Captured before the first frame was shown: take the frame the
+            # playback was about to show
+            frame_number = self.current_frame_pos
+            if self.frame_reader.frame_count > 0:
+                frame_number %= self.frame_reader.frame_count
+        frame = self.frame_reader.read(frame_number)
+        if frame is None:
+            messagebox.showerror("Error", f"Could not read frame {frame_number}.")
+            return
+        self.selected_frame_number = frame_number  # Store the frame number
+        self.current_frame = frame
+        self.frame_reader.release()
         self.video_window.destroy()
+        import cv2
         frame_rgb = cv2.cvtColor(self.current_frame, cv2.COLOR_BGR2RGB)
         self.show_frame_for_cropping(frame_rgb)
 
     def show_frame_for_cropping(self, frame):
+        from PIL import Image
         self.original_image = Image.fromarray(frame)
         self.rotated_image = self.original_image
         self.crop_window = tk.Toplevel(self.root)
@@ -269,21 +619,20 @@ class VideoAnalysisGUI:
             messagebox.showwarning("Warning", "Please select an image first.")
 
     def show_rotated_image(self):
+        import numpy as np
+        from preview import PreviewRenderer, photo_image
         screen_width = self.root.winfo_screenwidth()
         screen_height = self.root.winfo_screenheight()
         max_width = int(screen_width * 0.8)
         max_height = int(screen_height * 0.8)
         
-        if self.rotated_image.width > max_width or self.rotated_image.height > max_height:
-            self.scale_factor = min(max_width / self.rotated_image.width, max_height / self.rotated_image.height)
-            new_size = (int(self.rotated_image.width * self.scale_factor), int(self.rotated_image.height * self.scale_factor))
-            resized_image = self.rotated_image.resize(new_size, Image.LANCZOS)
-        else:
-            self.scale_factor = 1
-            resized_image = self.rotated_image
+        # The still used for cropping is rendered once, so it gets the high quality filter
+        renderer = PreviewRenderer((max_width, max_height), quality="high", convert=None)
+        resized_image = renderer.render(np.asarray(self.rotated_image))
+        self.scale_factor = renderer.scale
 
-        self.tk_image = ImageTk.PhotoImage(resized_image)
-        self.canvas_crop.config(width=resized_image.width, height=resized_image.height)
+        self.tk_image = photo_image(resized_image, master=self.crop_window)
+        self.canvas_crop.config(width=resized_image.shape[1], height=resized_image.shape[0])
         self.canvas_crop.create_image(0, 0, anchor=tk.NW, image=self.tk_image)
         self.canvas_crop.image = self.tk_image  # To prevent garbage collection
 
@@ -312,12 +661,16 @@ class VideoAnalysisGUI:
         y1 = min(orig_crop_start_y, orig_crop_end_y)
         x2 = max(orig_crop_start_x, orig_crop_end_x)
         y2 = max(orig_crop_start_y, orig_crop_end_y)
+        if x1 == x2 or y1 == y2:
+            # A click without a drag; keep the previous crop
+            return
 
         self.crop_coords = (x1, y1, x2, y2)
         self.cropped_image = self.rotated_image.crop(self.crop_coords)
         self.update_parameters()
 
     def preview_cropped_image(self):
+        from PIL import ImageTk
         self.tk_cropped_image = ImageTk.PhotoImage(self.cropped_image)
         self.cropped_image_window = tk.Toplevel(self.root)
         self.cropped_image_window.title("Cropped Image Preview")
@@ -364,7 +717,15 @@ class VideoAnalysisGUI:
         
         self.baseline_slider.config(to=self.tk_cropped_image.height())
 
+        # Edges and drop contour at the current thresholds, updated live
+        self.edge_label = ttk.Label(scrollable_frame.scrollable_frame, text="Edge preview")
+        self.edge_label.pack(pady=5)
+        self.edge_canvas = tk.Canvas(scrollable_frame.scrollable_frame, width=self.tk_cropped_image.width(), height=self.tk_cropped_image.height())
+        self.edge_canvas.pack()
+        self.start_edge_preview()
+
     def rotate_cropped_image(self, event):
+        from PIL import ImageTk
         if hasattr(self, 'original_image') and hasattr(self, 'crop_coords'):
             try:
                 new_angle = int(self.rotate_entry.get())
@@ -376,6 +737,8 @@ class VideoAnalysisGUI:
                 self.cropped_image = cropped_image
                 self.tk_cropped_image = ImageTk.PhotoImage(self.cropped_image)
                 self.update_image_window()
+                if self.edge_preview is not None:
+                    self.start_edge_preview()
                 self.update_parameters()
             except ValueError:
                 messagebox.showwarning("Warning", "Please enter a valid integer.")
@@ -391,6 +754,59 @@ class VideoAnalysisGUI:
             self.canvas.create_line(0, self.baseline_y, self.tk_cropped_image.width(), self.baseline_y, fill='red', width=2)
             self.baseline_slider.config(to=self.tk_cropped_image.height())
 
+    def start_edge_preview(self):
+        # A new still (new crop or rotation) gets a worker of its own. It is
+        # cropped from the captured frame the way the analysis crops, not
+        # taken from the PIL-rotated crop shown above it.
+        from edge_preview import EdgePreviewWorker, analysis_still
+        if self.edge_preview is not None:
+            self.edge_preview.stop()
+        image_rgb, gray = analysis_still(self.current_frame, self.crop_coords, self.rotation_angle)
+        self.edge_preview = EdgePreviewWorker(image_rgb, gray)
+        self.edge_canvas.config(width=self.tk_cropped_image.width(), height=self.tk_cropped_image.height())
+        self.request_edge_preview()
+        self.poll_edge_preview(self.image_window, self.edge_preview)
+
+    def schedule_edge_preview(self, value=None):
+        # Sliders call this for every tick while dragged; the worker only
+        # ever renders the newest request, so a short delay is enough
+        if self.edge_preview is None:
+            return
+        if self.edge_preview_job is not None:
+            self.root.after_cancel(self.edge_preview_job)
+        self.edge_preview_job = self.root.after(30, self.request_edge_preview)
+
+    def request_edge_preview(self):
+        self.edge_preview_job = None
+        if self.edge_preview is not None:
+            params = self.analysis_parameters()
+            self.edge_preview.submit(**{name: params[name] for name in ("baseline_y", "threshold1", "threshold2", "fitter")})
+
+    def poll_edge_preview(self, window, worker):
+        if worker is not self.edge_preview:
+            return
+        if not window.winfo_exists():
+            worker.stop()
+            self.edge_preview = None
+            return
+        result = worker.result()
+        if result is not None and result[2] is not None:
+            # Keep the last good overlay; the next slider move tries again
+            self.edge_label.config(text=f"Edge preview failed: {result[2]}")
+        elif result is not None:
+            from preview import photo_image
+            overlay, (left_angle, right_angle, _, _, _, fit_residual), _ = result
+            self.tk_edge_image = photo_image(overlay, master=window)
+            self.edge_canvas.delete("all")
+            self.edge_canvas.create_image(0, 0, anchor=tk.NW, image=self.tk_edge_image)
+            self.edge_canvas.image = self.tk_edge_image  # To prevent garbage collection
+            if math.isnan(left_angle):
+                self.edge_label.config(text="Edge preview: no drop contour found")
+            else:
+                self.edge_label.config(text=f"Edge preview: left {left_angle:.1f}°, right {right_angle:.1f}°, "
+                                            f"residual {fit_residual:.2f} px")
+        window.after(15, self.poll_edge_preview, window, worker)
+
     def update_parameters(self):
         self.param_display.config(state=tk.NORMAL)
         self.param_display.delete(1.0, tk.END)
@@ -413,7 +829,8 @@ class VideoAnalysisGUI:
             f"Target Path:\n{self.target_path}\n\n"
             f"{crop_coords_str}\n\n"
             f"Rotation: {self.rotation_angle}°\n"
-            f"Baseline: {self.baseline_y}"
+            f"Baseline: {self.baseline_y}\n\n"
+            f"Queued Jobs: {len(self.job_queue)}"
         )
         self.param_display.insert(tk.END, params)
         self.param_display.config(state=tk.DISABLED)
@@ -432,23 +849,200 @@ class VideoAnalysisGUI:
         self.baseline_y = int(value)
         if hasattr(self, 'tk_cropped_image'):
             self.update_image_window()
+        self.schedule_edge_preview()
         self.update_parameters()
 
+    def analysis_parameters(self):
+        from sampling import SamplingPolicy
+        return {
+            "frame_number": getattr(self, 'selected_frame_number', None),
+            "crop_coords": self.crop_coords,
+            "rotation_angle": self.rotation_angle,
+            "baseline_y": self.baseline_y,
+            "threshold1": self.threshold1_slider.get(),
+            "threshold2": self.threshold2_slider.get(),
+            "fitter": self.fitter_var.get(),
+            "sampling": SamplingPolicy().to_dict() if self.adaptive_sampling_var.get() else None,
+        }
+
     def add_to_queue(self):
         if self.selected_videos and self.target_path:
-            self.queue.append((self.selected_videos.copy(), self.target_path))
+            try:
+                self.job_queue.add(self.selected_videos.copy(), self.target_path, self.analysis_parameters())
+            except ManifestError as e:
+                messagebox.showerror("Error", str(e))
+                return
             self.reset_parameters()
         else:
             messagebox.showwarning("Warning", "Please select a video and a target path first.")
     
+    def export_queue(self):
+        # Writes the queue as a manifest for the headless runner, cli.py
+        jobs = [(videos, target, params) for _, videos, target, params in self.job_queue.pending()]
+        if not jobs:
+            messagebox.showwarning("Warning", "Queue is empty.")
+            return
+        path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Job manifest", "*.json")])
+        if path:
+            try:
+                save_manifest(path, jobs)
+            except OSError as e:
+                messagebox.showerror("Error", f"Could not export queue: {e}")
+
+    def retry_failed(self):
+        count = self.job_queue.requeue_failed()
+        if count:
+            self.update_parameters()
+            messagebox.showinfo("Retry", f"{count} failed video(s) queued again.")
+        else:
+            messagebox.showinfo("Retry", "No failed videos.")
+
     def start_analysis(self):
-        if self.queue:
-            for video, target in self.queue:
-                pass  # VideoProcessor.analyze_video(video, target)  # Uncomment when you have this function
-            messagebox.showinfo("Analysis", "Analysis completed.")
+        from batch import BatchExecutor
+        if self.executor is not None:
+            messagebox.showwarning("Warning", "Analysis is already running.")
+            return
+        pending = [(job_id, videos, target, params, self.job_queue.pending_videos(job_id))
+                   for job_id, videos, target, params in self.job_queue.pending()]
+        if pending:
+            try:
+                workers = int(self.workers_var.get())
+            except (tk.TclError, ValueError):
+                workers = os.cpu_count() or 1
+            workers = max(1, workers)
+            # Split videos into frame ranges when there are fewer videos than workers
+            video_count = sum(len(indices) for *_, indices in pending)
+            shards = max(1, workers // video_count)
+            self.executor = BatchExecutor(max_workers=min(workers, video_count), shards=shards,
+                                          checkpoint_interval=self.checkpoint_interval,
+                                          instrument=self.record_stats_var.get())
+            # Videos an earlier run finished are skipped; interrupted ones
+            # resume from their last checkpoint
+            for job_id, videos, target, params, indices in pending:
+                self.executor.submit(videos, target, params, job_id=job_id, indices=indices)
+            self.progress_bar["value"] = 0
+            self.start_button.config(state=tk.DISABLED)
+            self.cancel_button.config(state=tk.NORMAL)
+            self.root.after(200, self.poll_analysis)
         else:
             messagebox.showwarning("Warning", "Queue is empty.")
 
+    def poll_analysis(self):
+        progress = {}
+        for event in self.executor.poll():
+            kind, job_id, index = event[:3]
+            if kind == "progress":
+                progress[(job_id, index)] = event[3]
+            elif kind == "done":
+                self.job_queue.mark_done(job_id, index, event[3])
+            elif kind == "failed":
+                self.job_queue.mark_failed(job_id, index, event[3])
+            # Cancelled videos stay queued for the next run
+        if progress:
+            self.job_queue.record_progress(progress)
+        jobs = self.executor.jobs.values()
+        self.progress_bar["value"] = sum(job.fraction_done for job in jobs) / len(jobs)
+        if not self.executor.finished:
+            self.root.after(200, self.poll_analysis)
+            return
+
+        report = self.executor.failure_report()
+        cancelled = sum(len(job.cancelled) for job in jobs)
+        # Every video has finished, so the workers exit at once; waiting for
+        # them flushes the stats they sent after their last result
+        self.executor.shutdown(wait=True)
+        self.executor.poll()
+        self.last_utilization = self.executor.utilization()
+        self.executor = None
+        self.update_stats()
+        self.update_parameters()
+        self.start_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+        if report:
+            messagebox.showerror("Analysis", f"Some videos failed:\n\n{report}\n\n"
+                                             "\"Retry Failed\" queues them again.")
+        elif cancelled:
+            messagebox.showinfo("Analysis", "Analysis cancelled.")
+        else:
+            messagebox.showinfo("Analysis", "Analysis completed.")
+
+    def start_warm_up(self):
+        # Failures are left for the methods that import these for real to report
+        def run():
+            try:
+                warm_up()
+            except Exception:
+                pass
+
+        self.warm_up_thread = threading.Thread(target=run, daemon=True, name="warm-up")
+        self.warm_up_thread.start()
+
+    def load_fitters(self):
+        from fitting import FITTERS
+        self.fitter_combobox.config(values=FITTERS)
+
+    def cancel_analysis(self):
+        if self.executor is not None:
+            self.executor.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+
+    def toggle_stats(self):
+        # Recording starts from scratch each time it is switched on; a
+        # running batch keeps the setting it was started with
+        if self.record_stats_var.get():
+            instrumentation.disable()
+            instrumentation.enable()
+            self.refresh_stats()
+        else:
+            instrumentation.disable()
+            self.update_stats()
+
+    def refresh_stats(self):
+        if not self.record_stats_var.get():
+            return
+        self.update_stats()
+        self.root.after(STATS_REFRESH_MS, self.refresh_stats)
+
+    def update_stats(self):
+        lines = []
+        if self.executor is not None:
+            lines.append(f"workers: {self.executor.max_workers}, "
+                         f"utilization: {self.executor.utilization():.0%}, "
+                         f"queued videos: {self.executor.queue_depth}")
+        elif self.last_utilization is not None:
+            lines.append(f"last batch utilization: {self.last_utilization:.0%}")
+        reader = getattr(self, 'frame_reader', None)
+        if reader is not None:
+            cache = reader.cache
+            lines.append(f"preview cache: {cache.hits} hits, {cache.misses} misses, "
+                         f"{cache.size / 2**20:.0f} MB")
+        decoder = getattr(self, 'decoder', None)
+        if decoder is not None:
+            lines.append(f"preview frames: {decoder.frames_skipped} skipped, {decoder.frames_dropped} dropped")
+        recorder = instrumentation.recorder()
+        if recorder is not None:
+            if lines:
+                lines.append("")
+            lines.extend(instrumentation.format_summary(recorder.summary()))
+        elif not lines:
+            lines.append("Turn on Record stats to time the analysis stages.")
+        self.stats_display.config(state=tk.NORMAL)
+        self.stats_display.delete(1.0, tk.END)
+        self.stats_display.insert(tk.END, "\n".join(lines))
+        self.stats_display.config(state=tk.DISABLED)
+
+    def export_trace(self):
+        recorder = instrumentation.recorder()
+        if recorder is None or not recorder.events:
+            messagebox.showwarning("Warning", "Nothing recorded. Turn on Record stats first.")
+            return
+        path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Trace", "*.json")])
+        if path:
+            try:
+                recorder.export_trace(path)
+            except OSError as e:
+                messagebox.showerror("Error", f"Could not export trace: {e}")
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = VideoAnalysisGUI(root)
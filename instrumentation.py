@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Trace events kept per process; beyond this the oldest are dropped
+DEFAULT_MAX_EVENTS = 200000
+
+# Hot-path timings and counters. Off by default, and then span() hands out
+# one shared do-nothing context manager and count()/gauge() return at once,
+# so instrumented code costs a function call per site. enable() installs a
+# Recorder for this process; worker processes enable their own and ship
+# snapshots back to be merged (see batch.py).
+_recorder = None
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        recorder = _recorder
+        if recorder is not None:
+            recorder.add_span(self.name, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+
+class Recorder:
+    # Per-stage timing totals, counters and gauges, plus (with trace) the
+    # individual spans as events for export_trace(). Safe to feed from
+    # several threads. Timestamps come from perf_counter_ns, a system-wide
+    # monotonic clock, so events from worker processes line up.
+
+    def __init__(self, trace=True, max_events=DEFAULT_MAX_EVENTS):
+        self.stages = {}  # name -> [calls, total_ns, max_ns]
+        self.counters = {}
+        self.gauges = {}
+        self.events = deque(maxlen=max_events) if trace else None
+        self.process_names = {os.getpid(): "main"}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, duration):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = [1, duration, duration]
+            else:
+                stage[0] += 1
+                stage[1] += duration
+                if duration > stage[2]:
+                    stage[2] = duration
+            if self.events is not None:
+                self.events.append(("X", name, start, duration, os.getpid(), threading.get_ident()))
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+            if self.events is not None:
+                self.events.append(("C", name, time.perf_counter_ns(), value, os.getpid(), 0))
+
+    def snapshot(self, reset=False):
+        # Plain data, picklable, for merge() in another process
+        with self._lock:
+            snapshot = {
+                "stages": {name: list(stage) for name, stage in self.stages.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "events": list(self.events) if self.events is not None else [],
+                "process_names": dict(self.process_names),
+            }
+            if reset:
+                self.stages.clear()
+                self.counters.clear()
+                self.gauges.clear()
+                if self.events is not None:
+                    self.events.clear()
+        return snapshot
+
+    def merge(self, snapshot, events=True):
+        with self._lock:
+            for name, (calls, total, longest) in snapshot["stages"].items():
+                stage = self.stages.setdefault(name, [0, 0, 0])
+                stage[0] += calls
+                stage[1] += total
+                stage[2] = max(stage[2], longest)
+            for name, value in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.gauges.update(snapshot["gauges"])
+            if events and self.events is not None:
+                self.events.extend(snapshot["events"])
+                for pid, name in snapshot["process_names"].items():
+                    self.process_names.setdefault(pid, name)
+
+    def summary(self):
+        # {"stages": {name: {calls, total_s, mean_ms, max_ms}}, "counters", "gauges"}
+        with self._lock:
+            stages = {
+                name: {"calls": calls, "total_s": total / 1e9, "mean_ms": total / calls / 1e6, "max_ms": longest / 1e6}
+                for name, (calls, total, longest) in self.stages.items()
+            }
+            return {"stages": stages, "counters": dict(self.counters), "gauges": dict(self.gauges)}
+
+    def export_trace(self, path):
+        # Chrome trace event format, which chrome://tracing, Perfetto and
+        # speedscope open
+        with self._lock:
+            events = list(self.events or ())
+            process_names = dict(self.process_names)
+        trace = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}}
+                 for pid, name in process_names.items()]
+        for kind, name, start, value, pid, tid in events:
+            if kind == "X":
+                trace.append({"name": name, "cat": "stage", "ph": "X", "ts": start / 1e3, "dur": value / 1e3,
+                              "pid": pid, "tid": tid})
+            else:
+                trace.append({"name": name, "ph": "C", "ts": start / 1e3, "pid": pid, "args": {name: value}})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+def enable(trace=True, process_name=None):
+    global _recorder
+    if _recorder is None:
+        _recorder = Recorder(trace=trace)
+    if process_name:
+        _recorder.process_names[os.getpid()] = process_name
+    return _recorder
+
+
+def disable():
+    global _recorder
+    _recorder = None
+
+
+def enabled():
+    return _recorder is not None
+
+
+def recorder():
+    return _recorder
+
+
+def span(name):
+    # with span("decode"): ... times the block as stage "decode"
+    if _recorder is None:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def count(name, n=1):
+    recorder = _recorder
+    if recorder is not None:
+        recorder.count(name, n)
+
+
+def gauge(name, value):
+    recorder = _recorder
+    if recorder is not None:
+        recorder.gauge(name, value)
+
+
+def take_snapshot():
+    # This process's records so far, cleared so the next snapshot holds only
+    # what comes after; None while disabled
+    if _recorder is None:
+        return None
+    return _recorder.snapshot(reset=True)
+
+
+def format_summary(summary):
+    # Lines for a stats display from Recorder.summary()
+    lines = []
+    counters = summary["counters"]
+    if counters:
+        lines.extend(f"{name}: {value}" for name, value in sorted(counters.items()))
+    gauges = summary["gauges"]
+    if gauges:
+        lines.extend(f"{name}: {value:.3g}" if isinstance(value, float) else f"{name}: {value}"
+                     for name, value in sorted(gauges.items()))
+    if summary["stages"]:
+        if lines:
+            lines.append("")
+        lines.append(f"{'stage':<16}{'calls':>8}{'mean ms':>10}{'max ms':>10}{'total s':>9}")
+        for name, stage in sorted(summary["stages"].items(), key=lambda item: -item[1]["total_s"]):
+            lines.append(f"{name:<16}{stage['calls']:>8}{stage['mean_ms']:>10.3f}{stage['max_ms']:>10.2f}"
+                         f"{stage['total_s']:>9.2f}")
+    return lines
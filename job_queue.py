@@ -0,0 +1,115 @@
+import json
+import os
+import sqlite3
+import time
+
+from jobs import check_outputs, job_from_dict, job_to_dict
+
+DEFAULT_QUEUE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "drop-analysis", "queue.sqlite3")
+
+# Frames between checkpoints while a queued video is analysed
+DEFAULT_CHECKPOINT_INTERVAL = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS videos (
+    job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    video_index INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    frames_done INTEGER NOT NULL DEFAULT 0,
+    output TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, video_index)
+);
+"""
+
+
+class JobQueue:
+    # Durable analysis queue in a local SQLite database. Every job is stored
+    # with its full parameter set, in the manifest format from jobs.py, and
+    # each of its videos is tracked as queued, done or failed. Jobs survive
+    # the application closing or crashing; their videos' frame-level progress
+    # lives in the checkpoint parts next to the results (see checkpoints.py).
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def add(self, videos, target_path, params):
+        # Raises ManifestError when a video would overwrite the results of
+        # another one still queued. The stored jobs were validated when they
+        # were added, so only their videos and targets are read back.
+        rows = self._db.execute(
+            "SELECT jobs.job, videos.video_index FROM videos JOIN jobs ON jobs.id = videos.job_id "
+            "WHERE videos.status = 'queued'"
+        ).fetchall()
+        queued = []
+        for entry, index in rows:
+            entry = json.loads(entry)
+            queued.append(([entry["videos"][index]], entry["target_path"], None))
+        check_outputs(queued + [(videos, target_path, params)])
+        entry = json.dumps(job_to_dict(videos, target_path, params))
+        with self._db:
+            cursor = self._db.execute("INSERT INTO jobs (job, created) VALUES (?, ?)", (entry, time.time()))
+            job_id = cursor.lastrowid
+            self._db.executemany("INSERT INTO videos (job_id, video_index) VALUES (?, ?)",
+                                 [(job_id, index) for index in range(len(videos))])
+        return job_id
+
+    def remove(self, job_id):
+        with self._db:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def pending(self):
+        # [(job_id, videos, target_path, params)] of jobs with videos still to
+        # analyse, including any that were running when the app went down
+        rows = self._db.execute(
+            "SELECT id, job FROM jobs WHERE id IN (SELECT job_id FROM videos WHERE status = 'queued') ORDER BY id"
+        ).fetchall()
+        return [(job_id,) + job_from_dict(json.loads(entry)) for job_id, entry in rows]
+
+    def pending_videos(self, job_id):
+        rows = self._db.execute(
+            "SELECT video_index FROM videos WHERE job_id = ? AND status = 'queued' ORDER BY video_index", (job_id,)
+        ).fetchall()
+        return [index for index, in rows]
+
+    def record_progress(self, updates):
+        # updates: {(job_id, video_index): frames_done}
+        with self._db:
+            self._db.executemany("UPDATE videos SET frames_done = ? WHERE job_id = ? AND video_index = ?",
+                                 [(frames, job_id, index) for (job_id, index), frames in updates.items()])
+
+    def mark_done(self, job_id, video_index, output):
+        with self._db:
+            self._db.execute("UPDATE videos SET status = 'done', output = ? WHERE job_id = ? AND video_index = ?",
+                             (output, job_id, video_index))
+
+    def mark_failed(self, job_id, video_index, error):
+        with self._db:
+            self._db.execute("UPDATE videos SET status = 'failed', error = ? WHERE job_id = ? AND video_index = ?",
+                             (error, job_id, video_index))
+
+    def requeue_failed(self):
+        # Puts every failed video back in the queue; returns how many. The
+        # next run resumes them from their last checkpoint like any other.
+        with self._db:
+            cursor = self._db.execute("UPDATE videos SET status = 'queued', error = NULL WHERE status = 'failed'")
+        return cursor.rowcount
+
+    def __len__(self):
+        # Jobs with videos still to analyse. Counted in SQL: decoding the
+        # jobs would validate them, which imports NumPy and OpenCV
+        return self._db.execute("SELECT COUNT(DISTINCT job_id) FROM videos WHERE status = 'queued'").fetchone()[0]
@@ -0,0 +1,146 @@
+import json
+import os
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+# Analysis parameters a job carries next to its videos and target path; these
+# are passed straight to VideoProcessor
+JOB_PARAMETERS = ("frame_number", "crop_coords", "rotation_angle", "baseline_y", "threshold1", "threshold2",
+                  "fitter", "max_residual", "sampling")
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def output_stem(target_path, video_path):
+    # Results of a video are written to this path plus the results file
+    # extension
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(target_path, f"{name}_analysis")
+
+
+def check_outputs(jobs):
+    # Raises ManifestError when two videos of the (videos, target_path,
+    # params) jobs would write the same results: the same video listed twice,
+    # or videos of the same name from different directories, for one target
+    seen = {}
+    for videos, target_path, _ in jobs:
+        for video in videos:
+            key = os.path.normcase(os.path.abspath(output_stem(target_path, video)))
+            other = seen.get(key)
+            if other is None:
+                seen[key] = video
+                continue
+            if os.path.normcase(os.path.abspath(other)) == os.path.normcase(os.path.abspath(video)):
+                raise ManifestError(f"{video} is queued twice for {target_path}")
+            raise ManifestError(f"{other} and {video} would write the same results in {target_path}; "
+                                "use different target paths or rename one of them")
+
+
+def job_to_dict(videos, target_path, params):
+    entry = {"videos": list(videos), "target_path": target_path}
+    for name in JOB_PARAMETERS:
+        value = params.get(name)
+        if value is not None:
+            entry[name] = list(value) if name == "crop_coords" else value
+    return entry
+
+
+def job_from_dict(entry):
+    # Returns the (videos, target_path, params) tuple the GUI queue holds.
+    # The fitter and sampling checks pull in NumPy and OpenCV, which the GUI
+    # must not wait for at startup, so they are imported here.
+    from fitting import FITTERS
+    from sampling import SamplingPolicy
+
+    if not isinstance(entry, dict):
+        raise ManifestError(f"Job must be a table, got {entry!r}")
+    unknown = set(entry) - {"videos", "target_path"} - set(JOB_PARAMETERS)
+    if unknown:
+        raise ManifestError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+
+    videos = entry.get("videos")
+    if isinstance(videos, str):
+        videos = [videos]
+    if not videos or not all(isinstance(video, str) for video in videos):
+        raise ManifestError("Job needs a non-empty list of video paths in 'videos'")
+    target_path = entry.get("target_path")
+    if not isinstance(target_path, str) or not target_path:
+        raise ManifestError("Job needs a 'target_path'")
+
+    params = {name: entry.get(name) for name in JOB_PARAMETERS}
+    crop_coords = params["crop_coords"]
+    if crop_coords is not None:
+        if (not isinstance(crop_coords, (list, tuple)) or len(crop_coords) != 4
+                or not all(isinstance(value, int) and not isinstance(value, bool) for value in crop_coords)):
+            raise ManifestError(f"'crop_coords' must be four integers x1, y1, x2, y2, got {crop_coords!r}")
+        x1, y1, x2, y2 = crop_coords
+        if x1 >= x2 or y1 >= y2:
+            raise ManifestError(f"'crop_coords' must have x1 < x2 and y1 < y2, got {crop_coords!r}")
+        params["crop_coords"] = tuple(crop_coords)
+    frame_number = params["frame_number"]
+    if frame_number is not None and (not isinstance(frame_number, int) or isinstance(frame_number, bool)
+                                     or frame_number < 0):
+        raise ManifestError(f"'frame_number' must be a non-negative integer, got {frame_number!r}")
+    if params["fitter"] is None:
+        del params["fitter"]
+    elif params["fitter"] not in FITTERS:
+        raise ManifestError(f"'fitter' must be one of {', '.join(FITTERS)}, got {params['fitter']!r}")
+    if params["sampling"] is None:
+        del params["sampling"]
+    else:
+        if not isinstance(params["sampling"], dict):
+            raise ManifestError(f"'sampling' must be a table of sampling settings, got {params['sampling']!r}")
+        try:
+            SamplingPolicy.from_dict(params["sampling"])
+        except (TypeError, ValueError) as e:
+            raise ManifestError(f"Invalid 'sampling': {e}") from e
+    for name in ("rotation_angle", "baseline_y", "threshold1", "threshold2", "max_residual"):
+        if params[name] is None:
+            del params[name]
+        elif not isinstance(params[name], (int, float)) or isinstance(params[name], bool):
+            raise ManifestError(f"'{name}' must be a number, got {params[name]!r}")
+    return list(videos), target_path, params
+
+
+def load_manifest(path):
+    # JSON, or TOML for .toml files: a top-level "jobs" array of job tables
+    if os.path.splitext(path)[1].lower() == ".toml":
+        if tomllib is None:
+            raise ManifestError("Reading TOML manifests needs Python 3.11 or the tomli package")
+        with open(path, "rb") as f:
+            try:
+                data = tomllib.load(f)
+            except tomllib.TOMLDecodeError as e:
+                raise ManifestError(f"{path}: {e}") from e
+    else:
+        with open(path, encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ManifestError(f"{path}: {e}") from e
+
+    jobs = data.get("jobs") if isinstance(data, dict) else None
+    if not isinstance(jobs, list):
+        raise ManifestError(f"{path}: expected a top-level 'jobs' list")
+    jobs = [job_from_dict(entry) for entry in jobs]
+    try:
+        check_outputs(jobs)
+    except ManifestError as e:
+        raise ManifestError(f"{path}: {e}") from e
+    return jobs
+
+
+def save_manifest(path, jobs):
+    # Always written as JSON, which needs nothing outside the standard library
+    data = {"jobs": [job_to_dict(videos, target_path, params) for videos, target_path, params in jobs]}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
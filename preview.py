@@ -0,0 +1,86 @@
+import tkinter as tk
+
+import cv2
+import numpy as np
+
+# "fast" is for playback and scrubbing, "high" for stills the user works on
+PREVIEW_QUALITIES = ("fast", "high")
+
+
+def fit_size(width, height, max_width, max_height, upscale=False):
+    # Largest size with the aspect ratio of width x height inside the box
+    scale = min(max_width / width, max_height / height)
+    if not upscale:
+        scale = min(scale, 1.0)
+    return max(1, int(width * scale)), max(1, int(height * scale)), scale
+
+
+def photo_image(image_rgb, master=None):
+    # Hands the pixels to Tk as binary PPM data, without going through PIL
+    height, width = image_rgb.shape[:2]
+    header = f"P6 {width} {height} 255 ".encode("ascii")
+    return tk.PhotoImage(master=master, data=header + image_rgb.tobytes(), format="PPM")
+
+
+class PreviewRenderer:
+    # Scales frames into a display box keeping their aspect ratio, writing into
+    # buffers that are reused for as long as the frame and box sizes stay the
+    # same. The fast path first shrinks by a whole factor with INTER_AREA,
+    # which OpenCV does as a cheap block average, and then takes the remaining
+    # fraction with INTER_LINEAR.
+
+    def __init__(self, box=(600, 400), quality="fast", convert=cv2.COLOR_BGR2RGB, upscale=False):
+        self.box = box
+        self.quality = quality
+        self.convert = convert
+        self.upscale = upscale
+        self.scale = 1.0
+        self._layout_key = None
+        self._layout = None
+        self._output = None
+
+    def set_box(self, width, height):
+        # Returns whether the box changed, i.e. whether anything needs re-rendering
+        box = (max(1, int(width)), max(1, int(height)))
+        if box == self.box:
+            return False
+        self.box = box
+        return True
+
+    def output_shape(self, frame_shape):
+        return self._plan(frame_shape[1], frame_shape[0])[0]
+
+    def _plan(self, width, height):
+        key = (width, height, self.box, self.quality, self.upscale)
+        if key != self._layout_key:
+            out_width, out_height, self.scale = fit_size(width, height, *self.box, upscale=self.upscale)
+            step = None
+            if self.quality == "fast":
+                factor = min(width // out_width, height // out_height)
+                if factor >= 2:
+                    step = (width // factor, height // factor)
+            self._layout_key = key
+            self._layout = ((out_height, out_width, 3), step)
+            self._step_buffer = np.empty((step[1], step[0], 3), dtype=np.uint8) if step else None
+        return self._layout
+
+    def render(self, frame, out=None):
+        # Returns the display image; written into out when given, otherwise
+        # into a buffer owned by the renderer that the next call overwrites
+        shape, step = self._plan(frame.shape[1], frame.shape[0])
+        if out is None:
+            if self._output is None or self._output.shape != shape:
+                self._output = np.empty(shape, dtype=np.uint8)
+            out = self._output
+        size = (shape[1], shape[0])
+
+        if self.quality == "high":
+            cv2.resize(frame, size, dst=out, interpolation=cv2.INTER_LANCZOS4)
+        elif step is not None:
+            cv2.resize(frame, step, dst=self._step_buffer, interpolation=cv2.INTER_AREA)
+            cv2.resize(self._step_buffer, size, dst=out, interpolation=cv2.INTER_LINEAR)
+        else:
+            cv2.resize(frame, size, dst=out, interpolation=cv2.INTER_AREA)
+        if self.convert is not None:
+            cv2.cvtColor(out, self.convert, dst=out)
+        return out
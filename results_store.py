@@ -0,0 +1,263 @@
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+# Columnar results files. A file is a small header followed by chunks:
+#
+#   header  MAGIC, u32 header length, JSON {"version", "columns": [[name,
+#           dtype], ...], "sealed", "metadata"} padded to a multiple of 8 bytes
+#   chunk   CHUNK_MAGIC, u32 flags, u64 rows, i64 start, i64 stop, u32 CRC-32
+#           of the payload, u32 reserved; then each column's rows values back
+#           to back, padded to 8 bytes
+#
+# A chunk records the frame range [start, stop) its rows come from, and
+# flags marks the chunk the video ended in. Writers only ever append whole
+# chunks and fsync each one, so a file is readable up to its last complete
+# chunk even while it is written or after a crash; a torn trailing chunk is
+# recognised by its size or CRC and dropped. Sealed files were written whole
+# and renamed into place, cannot be torn and are not checked. Readers
+# memory-map the file and hand out the columns as NumPy views of the
+# mapping, so loading costs nothing per row: a finished file holds a single
+# chunk and every column is one contiguous view.
+RESULTS_EXTENSION = ".dropres"
+MAGIC = b"DROPRES\0"
+FORMAT_VERSION = 1
+CHUNK_MAGIC = b"CHNK"
+FLAG_EOF = 1
+
+_HEADER_START = struct.Struct("<8sI")
+_CHUNK_HEADER = struct.Struct("<4sIQqqII")
+_ALIGNMENT = 8
+
+
+class ResultsFormatError(ValueError):
+    pass
+
+
+def _padded(size):
+    return -(-size // _ALIGNMENT) * _ALIGNMENT
+
+
+def _encode_header(columns, metadata, sealed=False):
+    header = json.dumps({
+        "version": FORMAT_VERSION,
+        "columns": [[name, np.dtype(dtype).str] for name, dtype in columns],
+        "sealed": sealed,
+        "metadata": metadata or {},
+    }).encode("utf-8")
+    header += b" " * (_padded(_HEADER_START.size + len(header)) - _HEADER_START.size - len(header))
+    return _HEADER_START.pack(MAGIC, len(header)) + header
+
+
+def _decode_header(buffer):
+    # (columns as [(name, dtype)], sealed, metadata, offset of the first chunk)
+    if len(buffer) < _HEADER_START.size:
+        raise ResultsFormatError("Truncated results header")
+    magic, length = _HEADER_START.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ResultsFormatError("Not a results file")
+    end = _HEADER_START.size + length
+    if len(buffer) < end:
+        raise ResultsFormatError("Truncated results header")
+    try:
+        header = json.loads(bytes(buffer[_HEADER_START.size:end]))
+    except ValueError as e:
+        raise ResultsFormatError(f"Unreadable results header: {e}") from e
+    if header.get("version") != FORMAT_VERSION:
+        raise ResultsFormatError(f"Unsupported results format version {header.get('version')!r}")
+    columns = [(name, np.dtype(dtype)) for name, dtype in header["columns"]]
+    return columns, bool(header.get("sealed")), header.get("metadata", {}), end
+
+
+def _chunk_size(columns, rows):
+    return sum(_padded(rows * dtype.itemsize) for _, dtype in columns)
+
+
+def _scan(buffer, columns, offset, verify_last=True):
+    # [(offset of the chunk header, flags, rows, start, stop)] of the complete
+    # chunks from offset on. Every chunk but the last was fsynced before the
+    # next one was appended; only the last can hold garbage after a crash, so
+    # only its CRC is checked.
+    chunks = []
+    size = len(buffer)
+    while offset + _CHUNK_HEADER.size <= size:
+        magic, flags, rows, start, stop, crc, _ = _CHUNK_HEADER.unpack_from(buffer, offset)
+        payload = offset + _CHUNK_HEADER.size
+        end = payload + _chunk_size(columns, rows)
+        if magic != CHUNK_MAGIC or end > size:
+            break
+        chunks.append((offset, flags, rows, start, stop, crc))
+        offset = end
+    if verify_last:
+        while chunks:
+            offset, _, rows, _, _, crc = chunks[-1]
+            payload = offset + _CHUNK_HEADER.size
+            if zlib.crc32(buffer[payload:payload + _chunk_size(columns, rows)]) == crc:
+                break
+            chunks.pop()
+    return [chunk[:5] for chunk in chunks]
+
+
+def _write_chunk(f, columns, data, start, stop, eof):
+    # data maps every column name to an array of the same length. The
+    # columns are written straight from their arrays, without building the
+    # chunk in memory first.
+    arrays = [np.ascontiguousarray(data[name], dtype=dtype) for name, dtype in columns]
+    rows = len(arrays[0]) if arrays else 0
+    if any(len(array) != rows for array in arrays):
+        raise ValueError("Result columns differ in length")
+    buffers = []
+    crc = 0
+    for array in arrays:
+        padding = b"\0" * (_padded(array.nbytes) - array.nbytes)
+        for buffer in (memoryview(array).cast("B"), padding):
+            crc = zlib.crc32(buffer, crc)
+            buffers.append(buffer)
+    f.write(_CHUNK_HEADER.pack(CHUNK_MAGIC, FLAG_EOF if eof else 0, rows, start, stop, crc, 0))
+    for buffer in buffers:
+        f.write(buffer)
+
+
+class ResultsWriter:
+    # Appends chunks to a results file, creating it if needed. Reopening an
+    # existing file continues after its last complete chunk, so whatever a
+    # crash left behind is overwritten rather than read.
+
+    def __init__(self, path, columns, metadata=None):
+        self.path = path
+        self.columns = [(name, np.dtype(dtype)) for name, dtype in columns]
+        if not os.path.exists(path):
+            # Written aside and renamed so the file always has a whole header
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(_encode_header(self.columns, metadata))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        self._file = open(path, "r+b")
+        try:
+            buffer = self._file.read()
+            columns, sealed, self.metadata, offset = _decode_header(buffer)
+            if sealed:
+                raise ResultsFormatError(f"{path} is complete and cannot be appended to")
+            if columns != self.columns:
+                raise ResultsFormatError(f"{path} holds different columns")
+            chunks = _scan(buffer, columns, offset)
+            if chunks:
+                offset = chunks[-1][0] + _CHUNK_HEADER.size + _chunk_size(columns, chunks[-1][2])
+            self._file.seek(offset)
+            self._file.truncate()
+        except BaseException:
+            self._file.close()
+            raise
+
+    def append(self, data, start, stop, eof=False):
+        # One chunk with the rows of frames [start, stop); durable on return
+        _write_chunk(self._file, self.columns, data, start, stop, eof)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_results_file(path, columns, data, start=0, stop=None, metadata=None):
+    # A sealed results file of a single chunk, replacing path atomically.
+    # stop defaults to one past the last frame of a frame_index column.
+    if stop is None:
+        frames = data.get("frame_index")
+        stop = int(frames[-1]) + 1 if frames is not None and len(frames) else start
+    columns = [(name, np.dtype(dtype)) for name, dtype in columns]
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_encode_header(columns, metadata, sealed=True))
+        _write_chunk(f, columns, data, start, stop, True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return path
+
+
+class ResultsChunk:
+    def __init__(self, start, stop, eof, columns):
+        self.start = start
+        self.stop = stop
+        self.eof = eof
+        # name -> read-only view of the mapped file
+        self.columns = columns
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+
+class ResultsFile:
+    # Read-only, memory-mapped view of a results file. results["left_angle"]
+    # is the whole column: a view of the mapping when the file holds one
+    # chunk, as finished files do, else the chunks' views concatenated.
+    # Files still being written can be opened; they end at their last
+    # complete chunk. Views stay valid while they are referenced, even after
+    # close().
+
+    def __init__(self, path):
+        self.path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+        columns, self.sealed, self.metadata, offset = _decode_header(self._map)
+        self.names = tuple(name for name, _ in columns)
+        self._dtypes = dict(columns)
+        self.chunks = []
+        for offset, flags, rows, start, stop in _scan(self._map, columns, offset, verify_last=not self.sealed):
+            position = offset + _CHUNK_HEADER.size
+            views = {}
+            for name, dtype in columns:
+                views[name] = self._map[position:position + rows * dtype.itemsize].view(dtype)
+                position += _padded(rows * dtype.itemsize)
+            self.chunks.append(ResultsChunk(start, stop, bool(flags & FLAG_EOF), views))
+        self._columns = {}
+
+    @property
+    def complete(self):
+        # Whether the file reaches the end of the video
+        return any(chunk.eof for chunk in self.chunks)
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        column = self._columns.get(name)
+        if column is None:
+            if len(self.chunks) == 1:
+                column = self.chunks[0].columns[name]
+            elif self.chunks:
+                column = np.concatenate([chunk.columns[name] for chunk in self.chunks])
+            else:
+                column = np.empty(0, dtype=self._dtypes[name])
+            self._columns[name] = column
+        return column
+
+    def close(self):
+        # Drops this object's reference to the mapping; the OS unmaps it once
+        # no view is left
+        self.chunks = []
+        self._columns = {}
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
@@ -0,0 +1,104 @@
+from collections import deque
+
+import cv2
+import numpy as np
+
+# Settings a sampling policy takes, as stored in job manifests
+SAMPLING_FIELDS = ("threshold", "noise", "sparse_step", "padding", "downsample")
+
+
+class SamplingPolicy:
+    # Where to spend full analysis in a video. Every frame's crop is compared
+    # with the previous frame's at 1/downsample resolution. Where more than a
+    # threshold fraction of it changed by over noise gray levels, the drop is
+    # moving and every frame is analysed, from padding frames before the
+    # movement starts to padding frames after it stops. Elsewhere only every
+    # sparse_step-th frame is. A plain mean difference over the crop would
+    # drown a moving contact line in sensor noise.
+
+    def __init__(self, threshold=0.001, noise=8, sparse_step=10, padding=5, downsample=4):
+        if not 0 <= threshold <= 1:
+            raise ValueError(f"threshold must be a fraction between 0 and 1, got {threshold!r}")
+        if noise < 0:
+            raise ValueError(f"noise must not be negative, got {noise!r}")
+        for name, value in (("sparse_step", sparse_step), ("padding", padding), ("downsample", downsample)):
+            if not isinstance(value, int) or value < (0 if name == "padding" else 1):
+                raise ValueError(f"{name} must be a {'non-negative' if name == 'padding' else 'positive'} integer, got {value!r}")
+        self.threshold = threshold
+        self.noise = noise
+        self.sparse_step = sparse_step
+        self.padding = padding
+        self.downsample = downsample
+
+    @classmethod
+    def from_dict(cls, entry):
+        unknown = set(entry) - set(SAMPLING_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown sampling settings: {', '.join(sorted(unknown))}")
+        return cls(**entry)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in SAMPLING_FIELDS}
+
+    def sampler(self):
+        return FrameSampler(self)
+
+
+class FrameSampler:
+    # Applies a SamplingPolicy to the frames of one range as they are
+    # decoded. Skipped frames are kept back (as small grayscale crops) only
+    # while they could still become the lead-in of a movement.
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.frames_seen = 0
+        self.frames_analysed = 0
+        self._previous = None
+        self._small = None
+        self._hold = 0
+        self._pending = deque(maxlen=policy.padding)
+
+    def prime(self, gray):
+        # Takes gray only as the frame the next update() compares with,
+        # without deciding anything about it
+        self.activity(gray)
+
+    def holding(self, frame_index):
+        # Whether frames before frame_index are kept back as a possible
+        # lead-in
+        return bool(self._pending) and self._pending[0][0] < frame_index
+
+    def activity(self, gray):
+        # Fraction of the crop that changed since the previous frame
+        height, width = gray.shape[:2]
+        size = (max(width // self.policy.downsample, 1), max(height // self.policy.downsample, 1))
+        small = cv2.resize(gray, size, dst=self._small, interpolation=cv2.INTER_AREA)
+        # The older buffer is reused for the next frame
+        previous = self._previous
+        self._previous, self._small = small, previous
+        if previous is None or previous.shape != small.shape:
+            return None
+        return np.count_nonzero(cv2.absdiff(small, previous) > self.policy.noise) / small.size
+
+    def update(self, frame_index, timestamp, gray):
+        # [(frame_index, timestamp, gray)] to analyse now, in frame order:
+        # nothing, this frame, or this frame after its kept-back lead-in.
+        # gray may be a reused buffer; only kept-back frames are copied.
+        self.frames_seen += 1
+        activity = self.activity(gray)
+        moving = activity is None or activity > self.policy.threshold
+        if moving:
+            frames = list(self._pending) + [(frame_index, timestamp, gray)]
+            self._hold = self.policy.padding
+        elif self._hold or frame_index % self.policy.sparse_step == 0:
+            # Sparse frames are counted from the start of the video, not of
+            # the range, so every range of a video samples the same frames
+            frames = [(frame_index, timestamp, gray)]
+            self._hold = max(self._hold - 1, 0)
+        else:
+            if self.policy.padding:
+                self._pending.append((frame_index, timestamp, gray.copy()))
+            return []
+        self._pending.clear()
+        self.frames_analysed += len(frames)
+        return frames
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+# The modules live at the top of the repository and import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import drop_geometry, render_frame  # noqa: E402
+
+WIDTH, HEIGHT = 160, 120
+
+
+def write_video(path, indices, frame_count):
+    # MJPG video of the synthetic drop, frame i showing the drop of
+    # indices[i] in a cycle of frame_count; returns the analysis parameters
+    geometry, crop_coords, baseline_y = drop_geometry(WIDTH, HEIGHT, 0.0)
+    noise = [np.random.default_rng(0).integers(0, 6, (HEIGHT, WIDTH, 3), dtype=np.uint8)]
+    writer = cv2.VideoWriter(str(path), cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*"MJPG"), 25.0, (WIDTH, HEIGHT))
+    try:
+        for index in indices:
+            writer.write(render_frame(WIDTH, HEIGHT, index, frame_count, geometry, noise))
+    finally:
+        writer.release()
+    return {"crop_coords": crop_coords, "baseline_y": baseline_y}
+
+
+@pytest.fixture(scope="session")
+def drop_video(tmp_path_factory):
+    # 90 frames: still, moving, still, moving, still
+    indices = [0] * 20 + list(range(20)) + [20] * 20 + list(range(20, 35)) + [35] * 15
+    path = tmp_path_factory.mktemp("videos") / "drop.avi"
+    return str(path), write_video(path, indices, 60)
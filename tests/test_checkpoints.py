@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pytest
+
+from checkpoints import checkpoint_dir, read_parts
+from results_store import ResultsFile
+from video_processing import RESULT_COLUMNS, AnalysisCancelled, VideoProcessor
+
+
+class CountingProcessor(VideoProcessor):
+    frames = 0
+
+    def process_frame(self, frame):
+        self.frames += 1
+        return super().process_frame(frame)
+
+
+class CancelAfter:
+    # Set once is_set() was asked calls times, i.e. after that many frames
+    def __init__(self, calls):
+        self.calls = calls
+
+    def is_set(self):
+        self.calls -= 1
+        return self.calls < 0
+
+
+def read_columns(path):
+    with ResultsFile(path) as results:
+        return {name: np.array(results[name]) for name in RESULT_COLUMNS}
+
+
+def assert_same_results(path, expected_path):
+    actual, expected = read_columns(path), read_columns(expected_path)
+    for name in RESULT_COLUMNS:
+        np.testing.assert_array_equal(actual[name], expected[name], err_msg=name)
+
+
+@pytest.fixture(scope="module")
+def serial_output(drop_video, tmp_path_factory):
+    video_path, params = drop_video
+    return VideoProcessor(**params).analyze_video(video_path, str(tmp_path_factory.mktemp("serial")))
+
+
+def test_resume_analyses_only_unsaved_frames(drop_video, serial_output, tmp_path):
+    video_path, params = drop_video
+    target = str(tmp_path)
+    with pytest.raises(AnalysisCancelled):
+        CountingProcessor(**params).analyze_video(video_path, target, cancel=CancelAfter(35),
+                                                  checkpoint_interval=10)
+    processor = CountingProcessor(**params)
+    parts = read_parts(checkpoint_dir(target, video_path), processor.fingerprint(video_path))
+    assert [part[:2] for part in parts] == [(0, 10), (10, 20), (20, 30)]
+
+    output_path = processor.analyze_video(video_path, target, checkpoint_interval=10)
+    assert processor.frames == 90 - 30
+    assert_same_results(output_path, serial_output)
+    assert not os.path.exists(checkpoint_dir(target, video_path))
+
+    # Complete results of the same analysis are not redone
+    processor = CountingProcessor(**params)
+    assert processor.analyze_video(video_path, target, checkpoint_interval=10) == output_path
+    assert processor.frames == 0
+
+
+def test_parts_of_other_settings_are_ignored(drop_video, tmp_path):
+    video_path, params = drop_video
+    target = str(tmp_path)
+    with pytest.raises(AnalysisCancelled):
+        VideoProcessor(**params).analyze_video(video_path, target, cancel=CancelAfter(35),
+                                               checkpoint_interval=10)
+    processor = CountingProcessor(threshold1=40, **params)
+    processor.analyze_video(video_path, target, checkpoint_interval=10)
+    assert processor.frames == 90
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pytest
+
+from results_store import ResultsFile, ResultsFormatError, ResultsWriter, write_results_file
+
+COLUMNS = [("frame_index", np.int64), ("left_angle", np.float64)]
+
+
+def chunk(start, stop):
+    frames = np.arange(start, stop)
+    return {"frame_index": frames, "left_angle": frames * 0.5}
+
+
+def write_chunks(path, ranges, eof=False):
+    with ResultsWriter(path, COLUMNS) as writer:
+        for start, stop in ranges:
+            writer.append(chunk(start, stop), start, stop, eof=eof and stop == ranges[-1][1])
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "results.dropres")
+    write_chunks(path, [(0, 10), (10, 25)], eof=True)
+    with ResultsFile(path) as results:
+        assert [(c.start, c.stop, c.eof) for c in results.chunks] == [(0, 10, False), (10, 25, True)]
+        assert results.complete
+        np.testing.assert_array_equal(results["frame_index"], np.arange(25))
+        np.testing.assert_array_equal(results["left_angle"], np.arange(25) * 0.5)
+
+
+def test_truncated_chunk_is_dropped_and_overwritten(tmp_path):
+    path = str(tmp_path / "results.dropres")
+    write_chunks(path, [(0, 10), (10, 20)])
+    # A crash part way through the last chunk
+    os.truncate(path, os.path.getsize(path) - 12)
+    with ResultsFile(path) as results:
+        assert [(c.start, c.stop) for c in results.chunks] == [(0, 10)]
+        assert not results.complete
+
+    write_chunks(path, [(10, 30)], eof=True)
+    with ResultsFile(path) as results:
+        assert [(c.start, c.stop) for c in results.chunks] == [(0, 10), (10, 30)]
+        np.testing.assert_array_equal(results["frame_index"], np.arange(30))
+
+
+def test_corrupt_last_chunk_fails_its_crc(tmp_path):
+    path = str(tmp_path / "results.dropres")
+    write_chunks(path, [(0, 10), (10, 20)])
+    # Garbage in the last chunk's payload, with its size intact
+    with open(path, "r+b") as f:
+        f.seek(-8, os.SEEK_END)
+        f.write(b"\xff" * 8)
+    with ResultsFile(path) as results:
+        assert [(c.start, c.stop) for c in results.chunks] == [(0, 10)]
+
+    write_chunks(path, [(10, 20)])
+    with ResultsFile(path) as results:
+        np.testing.assert_array_equal(results["left_angle"], np.arange(20) * 0.5)
+
+
+def test_sealed_file_cannot_be_appended_to(tmp_path):
+    path = str(tmp_path / "results.dropres")
+    write_results_file(path, COLUMNS, chunk(0, 5))
+    with ResultsFile(path) as results:
+        assert results.sealed and results.complete
+    with pytest.raises(ResultsFormatError):
+        ResultsWriter(path, COLUMNS)
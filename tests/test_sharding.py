@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+import video_processing
+from results_store import ResultsFile
+from sampling import SamplingPolicy
+from video_processing import RESULT_COLUMNS, VideoProcessor, split_ranges
+
+
+def analyze(video_path, params, target, **kwargs):
+    sampling = kwargs.pop("sampling", None)
+    path = VideoProcessor(sampling=sampling, **params).analyze_video(video_path, target, **kwargs)
+    with ResultsFile(path) as results:
+        return {name: np.array(results[name]) for name in RESULT_COLUMNS}
+
+
+def test_split_ranges_covers_every_frame():
+    pieces = split_ranges([(0, 150), (300, None)], 1000, 4)
+    # 850 frames in pieces of at most 213, the last one left open-ended
+    assert pieces == [(0, 150), (300, 513), (513, 726), (726, 939), (939, None)]
+
+
+@pytest.mark.parametrize("sampling", [None, SamplingPolicy(sparse_step=7, padding=3)], ids=["every-frame", "sampling"])
+@pytest.mark.parametrize("checkpoint_interval", [None, 10])
+def test_sharded_results_equal_serial(drop_video, tmp_path, monkeypatch, sampling, checkpoint_interval):
+    # Small enough that the 90-frame video is cut into several shards
+    monkeypatch.setattr(video_processing, "MIN_SHARD_FRAMES", 20)
+    video_path, params = drop_video
+    serial = analyze(video_path, params, str(tmp_path / "serial"), sampling=sampling)
+    sharded = analyze(video_path, params, str(tmp_path / "sharded"), sampling=sampling, shards=3,
+                      checkpoint_interval=checkpoint_interval)
+    if sampling is not None:
+        assert len(serial["frame_index"]) < 90
+    for name in RESULT_COLUMNS:
+        np.testing.assert_array_equal(sharded[name], serial[name], err_msg=name)
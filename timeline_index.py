@@ -0,0 +1,145 @@
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+INDEX_VERSION = 1
+DEFAULT_THUMBNAILS = 200
+THUMBNAIL_HEIGHT = 48
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "drop-analysis", "timeline")
+
+
+class IndexCancelled(Exception):
+    pass
+
+
+def cache_key(video_path):
+    # A changed size or mtime means a different file behind the same path
+    stat = os.stat(video_path)
+    key = f"{INDEX_VERSION}|{os.path.abspath(video_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _open_packet_reader(video_path):
+    # Keyframe flags are only exposed for undecoded packets, which FFmpeg can
+    # hand out without decoding anything; other backends report none
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    if cap.isOpened():
+        return cap
+    cap.release()
+    return None
+
+
+class TimelineIndex:
+    # Per-video index for the Select Frame timeline: the timestamp of every
+    # frame, keyframe positions and a strip of small thumbnails. Built in one
+    # pass over the video and cached in CACHE_DIR under a key made from the
+    # video's path, size and mtime.
+
+    def __init__(self, timestamps, keyframes, thumbnail_frames, thumbnails):
+        self.timestamps = timestamps
+        self.keyframes = keyframes
+        self.thumbnail_frames = thumbnail_frames
+        self.thumbnails = thumbnails
+
+    @property
+    def frame_count(self):
+        return len(self.timestamps)
+
+    def timestamp(self, index):
+        return float(self.timestamps[index])
+
+    def frame_at_time(self, seconds):
+        index = int(np.searchsorted(self.timestamps, seconds, side="right")) - 1
+        return min(max(index, 0), self.frame_count - 1)
+
+    def keyframe_before(self, index):
+        # Last keyframe at or before index, or None when keyframes are unknown
+        position = int(np.searchsorted(self.keyframes, index, side="right"))
+        return int(self.keyframes[position - 1]) if position else None
+
+    def thumbnail_for(self, index):
+        # (frame index, RGB thumbnail) of the thumbnail nearest to index
+        position = int(np.searchsorted(self.thumbnail_frames, index))
+        if position == len(self.thumbnail_frames) or (
+                position and index - self.thumbnail_frames[position - 1] < self.thumbnail_frames[position] - index):
+            position -= 1
+        return int(self.thumbnail_frames[position]), self.thumbnails[position]
+
+    @classmethod
+    def build(cls, video_path, thumbnails=DEFAULT_THUMBNAILS, cancel=None):
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise IOError(f"Could not open video: {video_path}")
+
+        packets = _open_packet_reader(video_path)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        stride = max(1, frame_count // thumbnails)
+        timestamps = []
+        keyframes = []
+        thumbnail_frames = []
+        thumbnail_images = []
+        size = None
+        try:
+            # grab() every frame for its timestamp, retrieve() only thumbnails
+            while cap.grab():
+                index = len(timestamps)
+                timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0)
+                if packets is not None and packets.grab() and packets.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                    keyframes.append(index)
+                if index % stride == 0:
+                    ret, frame = cap.retrieve()
+                    if ret:
+                        if size is None:
+                            height, width = frame.shape[:2]
+                            size = (max(1, round(width * THUMBNAIL_HEIGHT / height)), THUMBNAIL_HEIGHT)
+                        thumbnail = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                        thumbnail_images.append(cv2.cvtColor(thumbnail, cv2.COLOR_BGR2RGB))
+                        thumbnail_frames.append(index)
+                if cancel is not None and index % 100 == 0 and cancel.is_set():
+                    raise IndexCancelled(video_path)
+        finally:
+            cap.release()
+            if packets is not None:
+                packets.release()
+
+        if thumbnail_images:
+            thumbnail_array = np.stack(thumbnail_images)
+        else:
+            thumbnail_array = np.empty((0, THUMBNAIL_HEIGHT, 0, 3), dtype=np.uint8)
+        return cls(
+            np.array(timestamps, dtype=np.float64),
+            np.array(keyframes, dtype=np.int64),
+            np.array(thumbnail_frames, dtype=np.int64),
+            thumbnail_array,
+        )
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside and renamed so a crash never leaves a truncated index
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, timestamps=self.timestamps, keyframes=self.keyframes,
+                     thumbnail_frames=self.thumbnail_frames, thumbnails=self.thumbnails)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["timestamps"], data["keyframes"], data["thumbnail_frames"], data["thumbnails"])
+
+    @classmethod
+    def load_or_build(cls, video_path, cache_dir=CACHE_DIR, cancel=None):
+        path = os.path.join(cache_dir, f"{cache_key(video_path)}.npz")
+        if os.path.exists(path):
+            try:
+                return cls.load(path)
+            except (OSError, ValueError, KeyError):
+                pass  # Unreadable cache entry; rebuild it
+        index = cls.build(video_path, cancel=cancel)
+        try:
+            index.save(path)
+        except OSError:
+            pass  # Read-only cache location; the index still works for this session
+        return index
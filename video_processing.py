@@ -1,7 +1,526 @@
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import queue
+import signal
+from concurrent.futures import ProcessPoolExecutor, wait
+
 import cv2
+import numpy as np
+
+import instrumentation
+from checkpoints import checkpoint_dir, clear_parts, merge_parts, missing_ranges, open_part, read_parts
+from fitting import make_fitter, refine_columns
+from instrumentation import span
+from jobs import output_stem
+from results_store import RESULTS_EXTENSION, ResultsFile, write_results_file
+from sampling import SamplingPolicy
+
+# Columns of the per-video results table, in order
+RESULT_COLUMNS = (
+    "frame_index",
+    "timestamp",
+    "left_angle",
+    "right_angle",
+    "base_width",
+    "height",
+    "volume",
+    "fit_residual",
+)
+# (name, dtype) of the columns as stored
+RESULT_SCHEMA = tuple((name, np.int64 if name == "frame_index" else np.float64) for name in RESULT_COLUMNS)
+
+# Shards shorter than this cost more in process start-up than they save
+MIN_SHARD_FRAMES = 200
+
+# Set in each shard worker process by _init_shard_worker
+_shard_events = None
+_shard_cancel = None
+
+
+class AnalysisCancelled(Exception):
+    pass
+
+
+def seek(cap, frame_index):
+    # Position cap so the next read() returns frame_index. Backends land on the
+    # keyframe at or before the target; whatever is left between that keyframe
+    # and the target is decoded and dropped here, so a range started mid-video
+    # sees exactly the frames a serial run would. Returns the frame index the
+    # capture ended up at, which is short of frame_index only past the end.
+    if frame_index > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if position > frame_index:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        position = 0
+    while position < frame_index and cap.grab():
+        position += 1
+    return position
+
+
+def _init_shard_worker(events, cancel, instrument=False):
+    global _shard_events, _shard_cancel
+    # Ctrl-C is handled by the main process, which cancels the shards
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # One process per core already; OpenCV's own threads would oversubscribe
+    cv2.setNumThreads(1)
+    _shard_events = events
+    _shard_cancel = cancel
+    if instrument:
+        instrumentation.enable(process_name=f"shard worker {os.getpid()}")
+
+
+def _analyze_shard(processor, video_path, shard, start, stop, progress_interval, parts_dir,
+                   checkpoint_interval):
+    # Returns the rows and this shard's instrumentation snapshot (None when
+    # instrumentation is off)
+    def progress(frames_done, total_frames):
+        _shard_events.put((shard, frames_done))
+
+    rows = processor.analyze_range(video_path, start, stop, progress=progress,
+                                   cancel=_shard_cancel, progress_interval=progress_interval,
+                                   parts_dir=parts_dir, checkpoint_interval=checkpoint_interval)
+    return rows, instrumentation.take_snapshot()
+
+
+def split_ranges(ranges, frame_count, pieces):
+    # Cut frame ranges [start, stop) into consecutive ranges of at most about
+    # 1/pieces of their total length, in order; stop=None (to the end of the
+    # video) is sized with frame_count and stays open-ended on the last piece
+    sizes = [max(0, (frame_count if stop is None else stop) - start) for start, stop in ranges]
+    total = sum(sizes)
+    pieces = max(1, min(pieces, total // MIN_SHARD_FRAMES))
+    target = -(-total // pieces)
+    result = []
+    for (start, stop), size in zip(ranges, sizes):
+        end = start + size
+        while end - start > target:
+            result.append((start, start + target))
+            start += target
+        result.append((start, stop))
+    return result
+
+
+def rotation_matrix(width, height, angle):
+    # Mirrors PIL's Image.rotate(angle, expand=True), which the GUI uses to pick
+    # crop_coords, so the analysis sees exactly the image the user cropped.
+    # Returns the inverse (output -> source) map for cv2.WARP_INVERSE_MAP and
+    # the size of the expanded output image.
+    rad = -math.radians(angle)
+    a, b = round(math.cos(rad), 15), round(math.sin(rad), 15)
+    d, e = -b, a
+    cx, cy = width / 2.0, height / 2.0
+    c = a * -cx + b * -cy + cx
+    f = d * -cx + e * -cy + cy
+
+    corners = ((0, 0), (width, 0), (width, height), (0, height))
+    xs = [a * x + b * y + c for x, y in corners]
+    ys = [d * x + e * y + f for x, y in corners]
+    new_width = math.ceil(max(xs)) - math.floor(min(xs))
+    new_height = math.ceil(max(ys)) - math.floor(min(ys))
+    dx, dy = -(new_width - width) / 2.0, -(new_height - height) / 2.0
+    c, f = a * dx + b * dy + c, d * dx + e * dy + f
+
+    # PIL samples at pixel centres (x + 0.5), OpenCV at integer coordinates
+    matrix = np.array([
+        [a, b, c + (a + b) * 0.5 - 0.5],
+        [d, e, f + (d + e) * 0.5 - 0.5],
+    ])
+    return matrix, (new_width, new_height)
+
 
 class VideoProcessor:
-    @staticmethod
-    def analyze_video(video_path, target_path):
-        # analysis code goes here
-        pass
+    def __init__(self, crop_coords=None, rotation_angle=0, baseline_y=0,
+                 threshold1=50, threshold2=150, frame_number=None, fit_rows=20,
+                 baseline_margin=2, fitter="polynomial", max_residual=None, subpixel=True,
+                 sampling=None):
+        self.crop_coords = tuple(crop_coords) if crop_coords else None
+        self.rotation_angle = rotation_angle
+        self.baseline_y = int(baseline_y)
+        self.threshold1 = threshold1
+        self.threshold2 = threshold2
+        self.frame_number = frame_number
+        self.fit_rows = fit_rows
+        # Rows right above the baseline hold the substrate edge, not the drop
+        self.baseline_margin = baseline_margin
+        # Contact-angle model, see fitting.FITTERS. Frames whose fit residual
+        # (in pixels) exceeds max_residual keep the residual but get NaN
+        # measurements, so bad frames drop out of plots automatically.
+        self.fitter = fitter
+        self.max_residual = max_residual
+        self.subpixel = subpixel
+        self._fitter = make_fitter(fitter, fit_rows)
+        # A SamplingPolicy, or its settings as a dict, to analyse only the
+        # frames around movement densely; None analyses every frame
+        if isinstance(sampling, dict):
+            sampling = SamplingPolicy.from_dict(sampling)
+        self.sampling = sampling
+
+        self._frame_size = None
+        self._matrix = None
+        self._source = None
+        self._roi_size = None
+        # Reused per-frame buffers
+        self._gray = None
+        self._roi = None
+
+    def fingerprint(self, video_path):
+        # Identifies results of this analysis of this video file. Checkpoint
+        # parts from other settings, another file of the same path or the
+        # file before it changed do not match.
+        try:
+            stat = os.stat(video_path)
+        except OSError as e:
+            raise IOError(f"Could not open video: {video_path}") from e
+        settings = {
+            "video_path": os.path.abspath(video_path),
+            "video_size": stat.st_size,
+            "video_mtime_ns": stat.st_mtime_ns,
+            "crop_coords": self.crop_coords,
+            "rotation_angle": self.rotation_angle,
+            "baseline_y": self.baseline_y,
+            "threshold1": self.threshold1,
+            "threshold2": self.threshold2,
+            "fit_rows": self.fit_rows,
+            "baseline_margin": self.baseline_margin,
+            "fitter": self.fitter,
+            "max_residual": self.max_residual,
+            "subpixel": self.subpixel,
+            "sampling": self.sampling.to_dict() if self.sampling else None,
+        }
+        encoded = json.dumps(settings, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _prepare(self, width, height):
+        # Geometry only depends on the frame size, so it is set up once per
+        # video: the source rectangle the crop maps back to, and the warp from
+        # that rectangle straight into a crop-sized output
+        self._frame_size = (width, height)
+        self._roi = None
+        self._gray = None
+        matrix, (rotated_width, rotated_height) = rotation_matrix(width, height, self.rotation_angle)
+        x1, y1, x2, y2 = self.crop_coords or (0, 0, rotated_width, rotated_height)
+        self._roi_size = (x2 - x1, y2 - y1)
+        if not self.rotation_angle % 360 and 0 <= x1 and 0 <= y1 and x2 <= width and y2 <= height:
+            # A plain slice of the frame. Crops reaching past the frame take
+            # the warp below with the identity matrix, which pads them with
+            # zeros to their full size like any rotated crop.
+            self._matrix = None
+            self._source = (slice(y1, y2), slice(x1, x2))
+            return
+
+        # Source positions sampled for the crop's corner pixels, plus a pixel
+        # for bilinear interpolation; everything else in the frame is never read
+        corners = np.array([[x1, y1, 1], [x2 - 1, y1, 1], [x2 - 1, y2 - 1, 1], [x1, y2 - 1, 1]], dtype=np.float64)
+        xs, ys = matrix @ corners.T
+        sx1 = min(max(math.floor(xs.min()) - 1, 0), width)
+        sy1 = min(max(math.floor(ys.min()) - 1, 0), height)
+        sx2 = max(min(math.ceil(xs.max()) + 2, width), sx1)
+        sy2 = max(min(math.ceil(ys.max()) + 2, height), sy1)
+        if sx1 == sx2 or sy1 == sy2:
+            # The crop lies entirely outside the rotated frame: every pixel is
+            # border, which warpAffine fills with zeros
+            self._source = None
+            return
+        self._source = (slice(sy1, sy2), slice(sx1, sx2))
+        # Output pixel (u, v) is rotated-image pixel (u + x1, v + y1), read
+        # relative to the source rectangle's corner
+        self._matrix = matrix.copy()
+        self._matrix[:, 2] += matrix[:, :2] @ (x1, y1) - (sx1, sy1)
+
+    def extract_roi(self, frame, gray=False):
+        # The crop of the rotated frame, computed from the part of the frame
+        # the crop maps back to only. With gray=True that part is converted to
+        # grayscale before the warp, which then moves a third of the bytes.
+        # The result is a buffer reused by the next call.
+        height, width = frame.shape[:2]
+        if self._frame_size != (width, height):
+            self._prepare(width, height)
+
+        if self._source is None:
+            shape = (self._roi_size[1], self._roi_size[0]) + (() if gray else frame.shape[2:])
+            if self._roi is None or self._roi.shape != shape or self._roi.dtype != frame.dtype:
+                self._roi = np.zeros(shape, dtype=frame.dtype)
+            return self._roi
+        source = frame[self._source]
+        if gray and source.ndim == 3:
+            if self._gray is None or self._gray.shape != source.shape[:2]:
+                self._gray = np.empty(source.shape[:2], dtype=source.dtype)
+            source = cv2.cvtColor(source, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        if self._matrix is None:
+            return source
+
+        shape = (self._roi_size[1], self._roi_size[0]) + source.shape[2:]
+        if self._roi is None or self._roi.shape != shape or self._roi.dtype != source.dtype:
+            self._roi = np.empty(shape, dtype=source.dtype)
+        return cv2.warpAffine(source, self._matrix, self._roi_size, dst=self._roi,
+                              flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+
+    def process_frame(self, frame):
+        # Returns (left_angle, right_angle, base_width, height, volume, fit_residual)
+        with span("roi"):
+            gray = self.extract_roi(frame, gray=True)
+        return self.process_roi(gray)
+
+    def process_roi(self, gray):
+        with span("edges"):
+            edges = cv2.Canny(gray, self.threshold1, self.threshold2)
+        with span("fit"):
+            return self.measure_edges(edges, gray if self.subpixel else None)
+
+    def drop_contour(self, edges, gray=None):
+        # Drop contour: outermost edge pixel on each row above the baseline, as
+        # (ys, left, right, baseline); with the grayscale ROI the columns are
+        # refined to sub-pixel positions. None without enough rows to fit.
+        rows, width = edges.shape
+        baseline = self.baseline_y if 0 < self.baseline_y <= rows else rows
+        mask = edges[:max(baseline - self.baseline_margin, 0)] > 0
+
+        has_edge = mask.any(axis=1)
+        ys = np.flatnonzero(has_edge)
+        if ys.size < 3:
+            return None
+        left = mask[ys].argmax(axis=1)
+        right = width - 1 - mask[ys, ::-1].argmax(axis=1)
+        if gray is not None:
+            left = refine_columns(gray, ys, left)
+            right = refine_columns(gray, ys, right)
+        return ys, left, right, baseline
+
+    def measure_edges(self, edges, gray=None):
+        contour = self.drop_contour(edges, gray)
+        if contour is None:
+            return (np.nan,) * 6
+        return self.measure_contour(*contour)
+
+    def measure_contour(self, ys, left, right, baseline):
+        left_angle, right_angle, base_width, volume, fit_residual = self._fitter.fit(ys, left, right, baseline)
+        drop_height = baseline - ys[0]
+        if volume is None:
+            # Axisymmetric volume from the per-row diameter, in pixels^3
+            radius = (right - left + 1) * 0.5
+            volume = math.pi * float(np.dot(radius, radius))
+        if self.max_residual is not None and not fit_residual <= self.max_residual:
+            return (np.nan,) * 5 + (fit_residual,)
+        return left_angle, right_angle, base_width, drop_height, volume, fit_residual
+
+    def analyze_video(self, video_path, target_path, progress=None, cancel=None,
+                      progress_interval=100, shards=1, checkpoint_interval=None):
+        # progress(frames_done, total_frames) is called every progress_interval
+        # frames; cancel is anything with is_set(), e.g. a multiprocessing.Event,
+        # and is checked after every frame.
+        # With shards > 1 the video is split into frame ranges analysed by
+        # separate processes. With a checkpoint_interval, results are saved
+        # every that many frames and a rerun after an interruption only
+        # analyses the frames that were not saved yet; a video whose complete
+        # results of the same analysis are already there is not analysed at
+        # all.
+        parts_dir = None
+        ranges = [(0, None)]
+        if checkpoint_interval:
+            fingerprint = self.fingerprint(video_path)
+            output_path = output_stem(target_path, video_path) + RESULTS_EXTENSION
+            try:
+                with ResultsFile(output_path) as results:
+                    if results.complete and results.metadata.get("fingerprint") == fingerprint:
+                        return output_path
+            except (OSError, ValueError):
+                pass
+            parts_dir = checkpoint_dir(target_path, video_path)
+            ranges = missing_ranges(read_parts(parts_dir, fingerprint))
+
+        if shards > 1:
+            rows = self._analyze_sharded(video_path, ranges, shards, progress, cancel, progress_interval,
+                                         parts_dir, checkpoint_interval)
+        else:
+            rows = []
+            frames_before = 0
+            for start, stop in ranges:
+                def range_progress(frames_done, total_frames, offset=frames_before):
+                    progress(offset + frames_done, offset + total_frames)
+
+                rows.extend(self.analyze_range(video_path, start, stop,
+                                               progress=range_progress if progress else None,
+                                               cancel=cancel, progress_interval=progress_interval,
+                                               parts_dir=parts_dir, checkpoint_interval=checkpoint_interval))
+                if stop is not None:
+                    frames_before += stop - start
+
+        if parts_dir is None:
+            return self.write_results(video_path, target_path, rows)
+        output_path = self.write_columns(video_path, target_path,
+                                         merge_parts(read_parts(parts_dir, fingerprint), RESULT_SCHEMA))
+        clear_parts(parts_dir)
+        return output_path
+
+    def analyze_range(self, video_path, start=0, stop=None, progress=None, cancel=None,
+                      progress_interval=100, parts_dir=None, checkpoint_interval=None):
+        # Analyse frames [start, stop); stop=None runs to the end of the video.
+        # With a parts_dir the rows are appended to a checkpoint part instead
+        # of being returned.
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise IOError(f"Could not open video: {video_path}")
+
+        rows = []
+        part = None
+        # Warm starts only make sense between consecutive frames
+        self._fitter.reset()
+        sampler = self.sampling.sampler() if self.sampling else None
+        # With sampling, the frames next to the range are decoded too, so
+        # that the range is sampled as in one pass over the video: the
+        # sampler is primed with the padding + 1 frames before start, and
+        # keeps going for up to padding frames after stop to see whether a
+        # movement right after the range needs the range's last frames as its
+        # lead-in. Only rows of the range's own frames are kept.
+        first, last = start, stop
+        if sampler is not None:
+            first = max(start - self.sampling.padding - 1, 0)
+            if stop is not None:
+                last = stop + self.sampling.padding
+        try:
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            if stop is not None:
+                total_frames = min(stop, total_frames)
+            total_frames -= start
+            # Falls short of first only when the video ends before it
+            frame_index = seek(cap, first)
+            eof = frame_index < first
+            part_start = start
+            if parts_dir is not None:
+                part = open_part(parts_dir, start, RESULT_SCHEMA, self.fingerprint(video_path))
+            while not eof and (last is None or frame_index < last):
+                if sampler is not None and stop is not None and frame_index >= stop \
+                        and not sampler.holding(stop):
+                    break
+                with span("decode"):
+                    ret, frame = cap.read()
+                if not ret:
+                    eof = True
+                    break
+                instrumentation.count("frames_decoded")
+                timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                if sampler is None:
+                    rows.append((frame_index, timestamp) + self.process_frame(frame))
+                    instrumentation.count("frames_analysed")
+                else:
+                    # Rows only for the sampled frames; a movement's lead-in
+                    # can reach back before the last checkpoint, which keeps
+                    # the merged rows in frame order all the same
+                    with span("roi"):
+                        gray = self.extract_roi(frame, gray=True)
+                    if 0 < frame_index == first < start:
+                        sampler.prime(gray)
+                        frame_index += 1
+                        continue
+                    with span("sample"):
+                        frames = [(index, stamp, crop) for index, stamp, crop
+                                  in sampler.update(frame_index, timestamp, gray)
+                                  if index >= start and (stop is None or index < stop)]
+                    for index, stamp, gray in frames:
+                        rows.append((index, stamp) + self.process_roi(gray))
+                    instrumentation.count("frames_analysed", len(frames))
+                    if not frames and frame_index >= start and (stop is None or frame_index < stop):
+                        instrumentation.count("frames_skipped")
+                frame_index += 1
+                if frame_index <= start or (stop is not None and frame_index > stop):
+                    # Priming the sampler, or looking past the range
+                    continue
+                if part is not None and frame_index - part_start >= checkpoint_interval:
+                    with span("checkpoint"):
+                        part.append(self.results_columns(rows), part_start, frame_index)
+                    rows = []
+                    part_start = frame_index
+                # Checked every frame: one frame can take a slow fitter a
+                # good part of a second, and is_set() costs next to nothing
+                if cancel is not None and cancel.is_set():
+                    raise AnalysisCancelled(video_path)
+                if progress is not None and (frame_index - start) % progress_interval == 0:
+                    progress(frame_index - start, total_frames)
+            if stop is not None and frame_index >= stop:
+                # Whatever lies past the range is left for the range after it
+                frame_index = stop
+                eof = False
+            elif frame_index < start:
+                # The video ended before the range
+                part_start = frame_index
+            if part is not None and (rows or eof):
+                with span("checkpoint"):
+                    part.append(self.results_columns(rows), part_start, frame_index, eof)
+                rows = []
+        finally:
+            cap.release()
+            if part is not None:
+                part.close()
+        return rows
+
+    def _analyze_sharded(self, video_path, ranges, shards, progress, cancel, progress_interval,
+                         parts_dir, checkpoint_interval):
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise IOError(f"Could not open video: {video_path}")
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        pieces = split_ranges(ranges, frame_count, shards)
+        total_frames = sum((frame_count if stop is None else stop) - start for start, stop in pieces)
+
+        context = multiprocessing.get_context("spawn")
+        events = context.Queue()
+        shard_cancel = context.Event()
+        frames_done = [0] * len(pieces)
+        with ProcessPoolExecutor(max_workers=min(shards, len(pieces)), mp_context=context,
+                                 initializer=_init_shard_worker,
+                                 initargs=(events, shard_cancel, instrumentation.enabled())) as executor:
+            futures = [
+                executor.submit(_analyze_shard, self, video_path, i, start, stop, progress_interval,
+                                parts_dir, checkpoint_interval)
+                for i, (start, stop) in enumerate(pieces)
+            ]
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.2)
+                if any(future.exception() is not None for future in done):
+                    shard_cancel.set()
+                if cancel is not None and cancel.is_set():
+                    shard_cancel.set()
+                while True:
+                    try:
+                        shard, count = events.get_nowait()
+                    except queue.Empty:
+                        break
+                    frames_done[shard] = count
+                if progress is not None:
+                    progress(sum(frames_done), total_frames)
+
+            # Shards cover consecutive frame ranges, so concatenating in shard
+            # order gives frame order
+            rows = []
+            recorder = instrumentation.recorder()
+            for future in futures:
+                shard_rows, snapshot = future.result()
+                rows.extend(shard_rows)
+                if recorder is not None and snapshot is not None:
+                    recorder.merge(snapshot)
+        return rows
+
+    def results_columns(self, rows):
+        # {name: array} of result rows, in the RESULT_SCHEMA dtypes
+        table = np.array(rows, dtype=np.float64).reshape(-1, len(RESULT_COLUMNS))
+        return {name: table[:, i].astype(dtype) for i, (name, dtype) in enumerate(RESULT_SCHEMA)}
+
+    def write_results(self, video_path, target_path, rows):
+        return self.write_columns(video_path, target_path, self.results_columns(rows))
+
+    def write_columns(self, video_path, target_path, columns):
+        # Writes <video name>_analysis.dropres to target_path, a results_store
+        # file readable with results_store.ResultsFile
+        os.makedirs(target_path, exist_ok=True)
+        output_path = output_stem(target_path, video_path) + RESULTS_EXTENSION
+        metadata = {"video_path": video_path, "fingerprint": self.fingerprint(video_path)}
+        with span("write"):
+            write_results_file(output_path, RESULT_SCHEMA, columns, metadata=metadata)
+        return output_path